@@ -0,0 +1,212 @@
+import csv
+import json
+import time
+import resource
+import argparse
+import itertools
+import concurrent.futures
+import numpy as np
+
+import kariba_moismcts
+import opening_book as opening_book_
+import rollout_policy
+import util
+
+class RandomAgent():
+    def __init__(self):
+        self.name = "random"
+
+    def select_action(self, game, rng):
+        return game.action_event(game.whose_turn, rng.choice(game.legal_action_ids(game.whose_turn)))
+
+class GreedyAgent():
+    '''
+    Plays the action that scores the most points right now, a random one among equals
+    '''
+    def __init__(self):
+        self.name = "greedy"
+
+    def select_action(self, game, rng):
+        action_ids = rng.permutation(game.legal_action_ids(game.whose_turn))
+        points = []
+        for action_id in action_ids:
+            score_before = game.scores_[game.whose_turn_]
+            game.apply_event(game.action_event(game.whose_turn, action_id))
+            points.append(game.scores_[game.whose_turn_] - score_before)
+            game.undo_event()
+        return game.action_event(game.whose_turn, action_ids[np.argmax(points)])
+
+class MOISMCTSAgent():
+    def __init__(self, n=500, time_budget_ms=None, rollout_batch_size=1, rollout_policy=None, rollout_depth=None, opening_book=None):
+        self.n                  = n
+        self.time_budget_ms     = time_budget_ms
+        self.rollout_batch_size = rollout_batch_size
+        self.rollout_policy     = rollout_policy
+        self.rollout_depth      = rollout_depth
+        self.opening_book       = opening_book
+        self.name = "moismcts(n={}{}{}{}{}{})".format(
+            n,
+            "" if time_budget_ms is None else ",time_budget_ms={}".format(time_budget_ms),
+            "" if rollout_batch_size == 1 else ",rollout_batch_size={}".format(rollout_batch_size),
+            "" if rollout_policy is None else ",rollout_policy={}".format(rollout_policy.name) + ("" if getattr(rollout_policy, "epsilon", 0) == 0 else "={}".format(rollout_policy.epsilon)),
+            "" if rollout_depth is None else ",rollout_depth={}".format(rollout_depth),
+            "" if opening_book is None else ",opening_book"
+        )
+
+    def select_action(self, game, rng):
+        searcher = kariba_moismcts.Searcher(game, rollout_batch_size=self.rollout_batch_size, seed=int(rng.integers(2**63)), rollout_policy=self.rollout_policy, rollout_depth=self.rollout_depth, opening_book=self.opening_book)
+        if searcher.n_book < self.n: # the simulations from the opening book count towards n, like in moismcts
+            searcher.run(n=self.n - searcher.n_book, time_budget_ms=self.time_budget_ms)
+        self.last_stats = searcher.stats()
+        return searcher.best_action()
+
+def agent_from_spec(spec, opening_book=None):
+    # "random", "greedy", "moismcts:500", "moismcts:500:64" (n and rollout_batch_size), "moismcts:500:64:greedy-capture" (and the rollout policy, see rollout_policy.from_name)
+    # or "moismcts:500:64:uniform:8" (and the rollout_depth).
+    # The opening book, if any, is used by the moismcts agents
+    kind, *args = spec.split(":")
+    if kind == "random":
+        return RandomAgent()
+    if kind == "greedy":
+        return GreedyAgent()
+    if kind == "moismcts":
+        n                  = int(args[0]) if len(args) > 0 else 500
+        rollout_batch_size = int(args[1]) if len(args) > 1 else 1
+        policy             = rollout_policy.from_name(args[2]) if len(args) > 2 else None
+        rollout_depth      = int(args[3]) if len(args) > 3 else None
+        return MOISMCTSAgent(n=n, rollout_batch_size=rollout_batch_size, rollout_policy=policy, rollout_depth=rollout_depth, opening_book=opening_book)
+    raise ValueError("unknown agent: " + spec)
+
+def play_game(agents, seed, first_player=0):
+    '''
+    One headless game between the agents (one per seat). Returns the final scores and per seat the move latencies and search statistics
+    '''
+    game_seed, agent_seed = util.spawn_seeds(seed, 2)
+    agent_rng = util.make_rng(agent_seed)
+
+    names = ["player{}".format(i) for i in range(len(agents))]
+    game  = kariba_moismcts.Kariba(player_names=names, whose_turn_=first_player, rng=util.make_rng(game_seed))
+
+    latencies     = [[] for _ in agents]
+    n_simulations = [0 for _ in agents]
+    search_time   = [0.0 for _ in agents]
+
+    while not game.is_final:
+        game.apply_event(game.random_card_draw())
+
+        seat  = game.whose_turn_
+        start = time.perf_counter()
+        action = agents[seat].select_action(game, agent_rng)
+        latencies[seat].append(time.perf_counter() - start)
+        if hasattr(agents[seat], "last_stats"):
+            n_simulations[seat] += agents[seat].last_stats["n_simulations"]
+            search_time[seat]   += agents[seat].last_stats["elapsed"]
+
+        game.apply_event(action)
+        game.next_turn()
+
+    return {
+        "scores"        : game.scores_.tolist(),
+        "latencies"     : latencies,
+        "n_simulations" : n_simulations,
+        "search_time"   : search_time,
+        "max_rss_kb"    : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # the peak memory of the process that played the game
+    }
+
+def play_seated_game(agents, seed, game_idx):
+    # the agents take turns at the first seat and at starting the game, the results are reported in the order of agents
+    n_seats = len(agents)
+    rotation = game_idx % n_seats
+    seated   = agents[rotation:] + agents[:rotation]
+    result   = play_game(seated, seed, first_player=(game_idx // n_seats) % n_seats)
+    unrotate = lambda values: values[-rotation:] + values[:-rotation] if rotation > 0 else values
+    return {key : unrotate(value) if isinstance(value, list) else value for key, value in result.items()}
+
+def wilson_interval(successes, n, z=1.96):
+    if n == 0:
+        return (0.0, 1.0)
+    p      = successes / n
+    centre = (p + z**2 / (2*n)) / (1 + z**2 / n)
+    margin = z * np.sqrt(p*(1-p)/n + z**2/(4*n**2)) / (1 + z**2 / n)
+    return (max(0.0, centre - margin), min(1.0, centre + margin))
+
+def run_match(agents, n_games=100, workers=1, seed=0):
+    '''
+    Plays n_games between the agents, in worker processes if workers > 1, and summarises playing strength and speed per agent.
+    A tie for the highest score counts as a split win among the tied agents
+    '''
+    seeds = util.spawn_seeds(seed, n_games)
+    start = time.perf_counter()
+    if workers == 1:
+        results = [play_seated_game(agents, seeds[i], i) for i in range(n_games)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(play_seated_game, [agents]*n_games, seeds, range(n_games), chunksize=max(1, n_games // (4*workers))))
+    elapsed = time.perf_counter() - start
+
+    scores = np.array([result["scores"] for result in results])
+    is_top = scores == scores.max(axis=1, keepdims=True)
+    wins   = (is_top / is_top.sum(axis=1, keepdims=True)).sum(axis=0)
+
+    report = {
+        "n_games"          : n_games,
+        "workers"          : workers,
+        "seed"             : seed,
+        "elapsed"          : elapsed,
+        "games_per_second" : n_games / elapsed,
+        "max_rss_kb"       : max(result["max_rss_kb"] for result in results),
+        "agents"           : []
+    }
+    for i, agent in enumerate(agents):
+        latencies     = np.array([latency for result in results for latency in result["latencies"][i]]) * 1000
+        n_simulations = sum(result["n_simulations"][i] for result in results)
+        search_time   = sum(result["search_time"][i] for result in results)
+        ci_low, ci_high = wilson_interval(wins[i], n_games)
+        report["agents"].append({
+            "agent"                  : agent.name,
+            "wins"                   : float(wins[i]),
+            "win_rate"               : float(wins[i] / n_games),
+            "win_rate_ci95_low"      : ci_low,
+            "win_rate_ci95_high"     : ci_high,
+            "mean_score"             : float(scores[:, i].mean()),
+            "latency_ms_p50"         : float(np.percentile(latencies, 50)),
+            "latency_ms_p90"         : float(np.percentile(latencies, 90)),
+            "latency_ms_p99"         : float(np.percentile(latencies, 99)),
+            "simulations_per_second" : n_simulations / search_time if search_time > 0 else None
+        })
+    return report
+
+def run_tournament(agents, n_games=100, workers=1, seed=0):
+    # a match of n_games between every pair of agents
+    return [run_match([agent_a, agent_b], n_games=n_games, workers=workers, seed=seed) for agent_a, agent_b in itertools.combinations(agents, 2)]
+
+def write_report(reports, path):
+    # json keeps the whole report, csv gets one row per agent per match
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(reports, f, indent=4)
+    else:
+        rows = [{**{key : value for key, value in report.items() if key != "agents"}, "match" : i, **agent} for i, report in enumerate(reports) for agent in report["agents"]]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless self-play between Kariba agents")
+    parser.add_argument("agents", nargs="+", help="random, greedy, moismcts:<n>, moismcts:<n>:<rollout_batch_size>[:<rollout_policy>[:<rollout_depth>]]")
+    parser.add_argument("--games", type=int, default=100, help="games per pair of agents")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="a .json or .csv file for the report")
+    parser.add_argument("--opening-book", default=None, help="an opening book made by opening_book.py, for the moismcts agents")
+    args = parser.parse_args()
+
+    opening_book = None if args.opening_book is None else opening_book_.OpeningBook(args.opening_book)
+    reports = run_tournament([agent_from_spec(spec, opening_book=opening_book) for spec in args.agents], n_games=args.games, workers=args.workers, seed=args.seed)
+    for report in reports:
+        for agent in report["agents"]:
+            print("{agent:40s} win rate {win_rate:.3f} [{win_rate_ci95_low:.3f}, {win_rate_ci95_high:.3f}]  latency p50 {latency_ms_p50:8.2f} ms  p99 {latency_ms_p99:8.2f} ms".format(**agent))
+        print("")
+    if args.out is not None:
+        write_report(reports, args.out)
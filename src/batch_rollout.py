@@ -0,0 +1,139 @@
+import numpy as np
+
+import util
+import rollout_policy
+
+# the arrays only pay for their overhead from about 16 games on: on the opening state a batch of 4 gives fewer game results per second
+# than 4 single games, a batch of 16 gives more (see benchmark.benchmark_rollout_batch_size). Smaller batches are played as single games
+MIN_BATCH_SIZE = 16
+
+class BatchKariba():
+    '''
+    A batch of B games of Kariba that are played out simultaneously, the actions are chosen by a rollout_policy (uniform by default).
+
+    The state of all games is held in integer arrays:
+    deck and field have shape (B, n_species), hands has shape (B, n_players, n_species),
+    scores has shape (B, n_players) and whose_turn_ has shape (B,).
+    Games that are final are left untouched while the others keep playing.
+    '''
+    def __init__(self, deck, field, hands, scores, whose_turn_, max_n_hand=5, rng=None, policy=None):
+        self.deck        = deck
+        self.field       = field
+        self.hands       = hands
+        self.scores      = scores
+        self.whose_turn_ = whose_turn_
+        self.max_n_hand  = max_n_hand
+
+        self.batch_size, self.n_players, self.n_species = hands.shape
+        self.batch_idx = np.arange(self.batch_size)
+
+        self.rng    = util.make_rng() if rng is None else rng
+        self.policy = rollout_policy.UniformPolicy() if policy is None else policy
+
+    @classmethod
+    def from_game(cls, game, batch_size, rng=None, policy=None):
+        # B copies of the same Kariba game
+        return cls(
+            deck        = np.tile(game.deck, (batch_size, 1)),
+            field       = np.tile(game.field, (batch_size, 1)),
+            hands       = np.tile(game.hands_, (batch_size, 1, 1)),
+            scores      = np.tile(game.scores_, (batch_size, 1)),
+            whose_turn_ = np.full(batch_size, game.whose_turn_),
+            max_n_hand  = game.max_n_hand,
+            rng         = rng,
+            policy      = policy
+        )
+
+    @property
+    def is_final(self):
+        return (self.deck.sum(axis=1) == 0) & (self.hands.sum(axis=2) == 0).any(axis=1)
+
+    @property
+    def leading_player_(self):
+        return np.argmax(self.scores, axis=1) # the first player among equals, like Kariba.leading_player
+
+    def current_hands(self):
+        return self.hands[self.batch_idx, self.whose_turn_]
+
+    def random_card_draw(self, active):
+        # refill the hand of the player whose turn it is, by sampling from a multivariate hypergeometric distribution one species at a time
+        n_hand    = self.current_hands().sum(axis=1)
+        n_to_draw = np.where(active, np.minimum(self.max_n_hand - n_hand, self.deck.sum(axis=1)), 0)
+
+        cards      = np.zeros_like(self.deck)
+        n_left     = self.deck.sum(axis=1)
+        for species in range(self.n_species):
+            n_left -= self.deck[:, species]
+            cards[:, species] = self.rng.hypergeometric(self.deck[:, species], n_left, n_to_draw)
+            n_to_draw -= cards[:, species]
+
+        self.deck -= cards
+        self.hands[self.batch_idx, self.whose_turn_] += cards
+
+    def policy_action(self, active):
+        # the species and count of the action the policy picks in every game, a count of 0 for the games that are not active
+        action_ids = self.policy.action_ids(self.current_hands(), self.field, self.max_n_hand, self.rng)
+        return action_ids // self.max_n_hand, np.where(active, action_ids % self.max_n_hand + 1, 0)
+
+    def apply_action(self, active, species, counts):
+        self.hands[self.batch_idx, self.whose_turn_, species] -= counts
+        self.field[self.batch_idx, species]                   += counts
+
+        # the chase rule: 3 or more animals of a species chase away the closest weaker species on the field, mice chase away elephants
+        is_chasing = active & (self.field[self.batch_idx, species] >= 3)
+
+        weaker      = (self.field > 0) & (np.arange(self.n_species)[None, :] < species[:, None])
+        has_weaker  = weaker.any(axis=1)
+        closest     = self.n_species - 1 - np.argmax(weaker[:, ::-1], axis=1)
+        fear_animal = np.where(species == 0, self.n_species - 1, closest)
+        is_chasing &= (species == 0) | has_weaker
+
+        n_chased = np.where(is_chasing, self.field[self.batch_idx, fear_animal], 0)
+        self.scores[self.batch_idx, self.whose_turn_] += n_chased
+        self.field[self.batch_idx, fear_animal]       -= n_chased
+
+    def next_turn(self, active):
+        self.whose_turn_ = np.where(active, (self.whose_turn_ + 1) % self.n_players, self.whose_turn_)
+
+    def play_turns(self, max_depth=None):
+        # play all games to the end, or until max_depth turns have been played
+        active = ~self.is_final
+        depth  = 0
+        while active.any() and (max_depth is None or depth < max_depth):
+            self.random_card_draw(active)
+            species, counts = self.policy_action(active)
+            self.apply_action(active, species, counts)
+            self.next_turn(active)
+            active = ~self.is_final
+            depth += 1
+
+    def rollout(self):
+        # play all games to the end and return the index of the winner of each game
+        self.play_turns()
+        return self.leading_player_
+
+    def rollout_rewards(self, max_depth, evaluator):
+        '''
+        Play at most max_depth turns and return the rewards of every game, shape (B, n_players):
+        1 for the winner of a game that has ended, the win probabilities of the evaluator (see evaluation.StaticEvaluator) for the others
+        '''
+        self.play_turns(max_depth)
+        rewards = np.eye(self.n_players)[self.leading_player_]
+        is_cut  = ~self.is_final
+        if is_cut.any():
+            rewards[is_cut] = evaluator.win_probabilities_batch(self.scores[is_cut], self.hands[is_cut], self.field[is_cut], self.deck[is_cut], self.whose_turn_[is_cut], self.max_n_hand)
+        return rewards
+
+def rollout_wins(game, batch_size, rng=None, policy=None, max_depth=None, evaluator=None):
+    '''
+    Plays batch_size games with the rollout policy from the state of a Kariba game at the start of a turn (before the card draw)
+    and returns the number of games won by each player, in the order of game.player_names.
+    With max_depth, the games are cut off after max_depth turns and the evaluator estimates who wins, so the wins can be fractional
+    '''
+    return batch_wins(BatchKariba.from_game(game, batch_size, rng=rng, policy=policy), max_depth, evaluator)
+
+def batch_wins(batch, max_depth=None, evaluator=None):
+    # the wins of each player over the games of a BatchKariba, see rollout_wins. A module function, so a process pool can run it
+    if max_depth is None:
+        return np.bincount(batch.rollout(), minlength=batch.n_players)
+    return batch.rollout_rewards(max_depth, evaluator).sum(axis=0)
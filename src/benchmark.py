@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import itertools
+import tracemalloc
+import concurrent.futures
+import numpy as np
+
+import kariba_moismcts
+import rollout_policy
+import arena
+import util
+
+def opening_state(seed=0):
+    # a root state like the one the AI faces at its first move: the player whose turn it is has just drawn a hand
+    kariba = kariba_moismcts.Kariba(rng=util.make_rng(seed))
+    kariba.apply_event(kariba.random_card_draw())
+    return kariba
+
+def benchmark_workers(max_workers=None, n=2000, n_decisions=3):
+    '''
+    Decision throughput of root-parallel MOISMCTS as the number of worker processes goes from 1 to max_workers.
+    Every decision runs n simulations in total, divided over the workers.
+    '''
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    root_state  = opening_state()
+
+    results = []
+    for workers in range(1, max_workers+1):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            kariba_moismcts.moismcts(root_state, n=workers, workers=workers, executor=executor, seed=0) # warm up the pool so process start-up is not measured
+            start = time.perf_counter()
+            for _ in range(n_decisions):
+                kariba_moismcts.moismcts(root_state, n=n, workers=workers, executor=executor, seed=0)
+            elapsed = time.perf_counter() - start
+        results.append({
+            "workers"                : workers,
+            "decisions_per_second"   : n_decisions / elapsed,
+            "simulations_per_second" : n_decisions * n / elapsed
+        })
+        print("workers: {workers:3d}  decisions/s: {decisions_per_second:8.3f}  simulations/s: {simulations_per_second:10.1f}".format(**results[-1]))
+    return results
+
+def benchmark_rollout_batch_size(batch_sizes=(1, 4, 16, 64, 256), time_budget_ms=2000):
+    '''
+    Game results per second of a search that evaluates every leaf with a batch of random games
+    '''
+    root_state = opening_state()
+
+    results = []
+    for rollout_batch_size in batch_sizes:
+        searcher = kariba_moismcts.Searcher(root_state, rollout_batch_size=rollout_batch_size, seed=0)
+        searcher.run(time_budget_ms=time_budget_ms)
+        stats = searcher.stats()
+        results.append({
+            "rollout_batch_size"     : rollout_batch_size,
+            "n_simulations"          : stats["n_simulations"],
+            "simulations_per_second" : stats["simulations_per_second"]
+        })
+        print("rollout_batch_size: {rollout_batch_size:4d}  simulations: {n_simulations:8d}  simulations/s: {simulations_per_second:10.1f}".format(**results[-1]))
+    return results
+
+def benchmark_rollout_policies(policies=("uniform", "greedy-capture", "epsilon-greedy"), ns=(25, 50, 100, 200), opponent="greedy", n_games=100, workers=1, seed=0):
+    '''
+    Iterations to strength: the win rate of MOISMCTS with each rollout policy against a fixed opponent, as the number of simulations per move grows.
+    For every policy, iterations_to_strength is the smallest n at which it wins at least as often as the first policy does at the largest n (None if it never does)
+    '''
+    results = []
+    for policy in policies:
+        for n in ns:
+            agent  = arena.MOISMCTSAgent(n=n, rollout_policy=rollout_policy.from_name(policy))
+            report = arena.run_match([agent, arena.agent_from_spec(opponent)], n_games=n_games, workers=workers, seed=seed)
+            results.append({
+                "rollout_policy"         : policy,
+                "n"                      : n,
+                "win_rate"               : report["agents"][0]["win_rate"],
+                "win_rate_ci95_low"      : report["agents"][0]["win_rate_ci95_low"],
+                "win_rate_ci95_high"     : report["agents"][0]["win_rate_ci95_high"],
+                "simulations_per_second" : report["agents"][0]["simulations_per_second"]
+            })
+            print("rollout_policy: {rollout_policy:20s} n: {n:5d}  win rate: {win_rate:.3f} [{win_rate_ci95_low:.3f}, {win_rate_ci95_high:.3f}]  simulations/s: {simulations_per_second:8.1f}".format(**results[-1]))
+
+    target = results[len(ns)-1]["win_rate"]
+    for policy in policies:
+        strong_enough = [result["n"] for result in results if result["rollout_policy"] == policy and result["win_rate"] >= target]
+        print("rollout_policy: {:20s} iterations to strength: {}".format(policy, min(strong_enough) if len(strong_enough) > 0 else None))
+    return results
+
+def endgame_state(seed=0, max_deck=6):
+    # a random game played on until the deck holds at most max_deck cards, right after the card draw
+    kariba = kariba_moismcts.Kariba(rng=util.make_rng(seed))
+    rng    = util.make_rng(seed + 1)
+    kariba.apply_event(kariba.random_card_draw())
+    while kariba.deck.sum() > max_deck:
+        kariba.apply_event(kariba.action_event(kariba.whose_turn, rng.choice(kariba.legal_action_ids(kariba.whose_turn))))
+        kariba.next_turn()
+        kariba.apply_event(kariba.random_card_draw())
+    return kariba
+
+def benchmark_stratified_draws(n_positions=10, n=150, n_reference=6000, n_seeds=10, max_deck=6):
+    '''
+    End-game decisions with sampled and with stratified card draws: how often a search of n simulations picks the action
+    a reference search of n_reference simulations (with sampled draws) values highest, and the error of the action values
+    '''
+    results = []
+    for stratified_draws in (False, True):
+        agreement, squared_errors = [], []
+        for position in range(n_positions):
+            root_state = endgame_state(position, max_deck)
+            reference  = kariba_moismcts.Searcher(root_state, seed=0)
+            reference.run(n=n_reference)
+            reference_values = {action["action_id"] : w / n_action for action, n_action, w in reference.simulators.tree_dict[root_state.whose_turn].root_statistics()}
+            for seed in range(1, n_seeds+1):
+                searcher = kariba_moismcts.Searcher(root_state, seed=seed, stratified_draws=stratified_draws)
+                searcher.run(n=n)
+                agreement.append(reference_values[searcher.best_action()["action_id"]] >= max(reference_values.values()) - 0.01)
+                squared_errors += [(w / n_action - reference_values[action["action_id"]])**2 for action, n_action, w in searcher.simulators.tree_dict[root_state.whose_turn].root_statistics()]
+        results.append({
+            "stratified_draws" : stratified_draws,
+            "agreement"        : float(np.mean(agreement)),
+            "value_rmse"       : float(np.sqrt(np.mean(squared_errors)))
+        })
+        print("stratified_draws: {stratified_draws!s:5s}  best action agreement: {agreement:.3f}  value rmse: {value_rmse:.4f}".format(**results[-1]))
+    return results
+
+def benchmark_tree_parallel(ns=(250, 500, 1000, 2000), worker_counts=(1, 2, 4), executors=("thread", "process"), rollout_batch_size=1, virtual_loss=1):
+    '''
+    Tree-parallel MOISMCTS (Searcher.run_parallel) against the sequential search, as the number of simulations and of workers grows.
+    speedup is the time of the sequential search of the same n divided by the time of the parallel one, the pool start-up is not measured
+    '''
+    root_state = opening_state()
+    pools      = {"thread" : concurrent.futures.ThreadPoolExecutor, "process" : concurrent.futures.ProcessPoolExecutor}
+
+    results = []
+    for n in ns:
+        baseline = kariba_moismcts.Searcher(root_state, rollout_batch_size=rollout_batch_size, seed=0)
+        baseline.run(n=n)
+        print("n: {:6d}  sequential  {:8.3f} s  simulations/s: {:10.1f}".format(n, baseline.elapsed, baseline.n_simulations / baseline.elapsed))
+        for executor_kind in executors:
+            for workers in worker_counts:
+                with pools[executor_kind](max_workers=workers) as executor:
+                    kariba_moismcts.Searcher(root_state, seed=0).run_parallel(executor, n=2*workers) # warm up the pool
+                    searcher = kariba_moismcts.Searcher(root_state, rollout_batch_size=rollout_batch_size, seed=0)
+                    searcher.run_parallel(executor, n=n, max_in_flight=2*workers, virtual_loss=virtual_loss)
+                results.append({
+                    "n"                      : n,
+                    "executor"               : executor_kind,
+                    "workers"                : workers,
+                    "elapsed"                : searcher.elapsed,
+                    "speedup"                : baseline.elapsed / searcher.elapsed,
+                    "simulations_per_second" : searcher.n_simulations / searcher.elapsed,
+                    "same_best_action"       : searcher.best_action()["action_id"] == baseline.best_action()["action_id"]
+                })
+                print("n: {n:6d}  {executor:7s} x{workers:<3d} {elapsed:8.3f} s  simulations/s: {simulations_per_second:10.1f}  speedup: {speedup:5.2f}  same best action: {same_best_action}".format(**results[-1]))
+    return results
+
+def benchmark_variants(players=(2, 3, 4), species=(8, 10, 12), cards_per_species=(None, 12), time_budget_ms=1000, seed=0):
+    '''
+    Throughput and memory of the search as the game grows: for every number of players, species and cards per species (None: as many as species),
+    the simulations per second of a search from the opening within time_budget_ms, the nodes in its trees
+    and the peak memory the same search allocates, measured with tracemalloc in a second run of as many simulations (tracing slows the search down)
+    '''
+    results = []
+    for n_players, n_species, cards in itertools.product(players, species, cards_per_species):
+        if cards == n_species and None in cards_per_species: # the same deck as cards=None
+            continue
+        root_state = kariba_moismcts.Kariba.variant(n_players, n_species, cards_per_species=cards, rng=util.make_rng(seed))
+        root_state.apply_event(root_state.random_card_draw())
+
+        searcher = kariba_moismcts.Searcher(root_state, seed=seed)
+        searcher.run(time_budget_ms=time_budget_ms)
+
+        tracemalloc.start()
+        kariba_moismcts.Searcher(root_state, seed=seed).run(n=searcher.n_simulations) # the same seed and n give the same trees
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({
+            "n_players"              : n_players,
+            "n_species"              : n_species,
+            "deck_size"              : int(root_state.deck.sum() + root_state.hands_.sum()),
+            "n_simulations"          : searcher.n_simulations,
+            "simulations_per_second" : searcher.n_simulations / searcher.elapsed,
+            "n_nodes"                : sum(tree.n_nodes for tree in searcher.simulators.trees),
+            "peak_mb"                : peak_bytes / 2**20
+        })
+        print("players: {n_players}  species: {n_species:3d}  deck: {deck_size:4d}  simulations/s: {simulations_per_second:8.1f}  nodes: {n_nodes:7d}  peak memory: {peak_mb:7.2f} MB".format(**results[-1]))
+    return results
+
+if __name__ == "__main__":
+    benchmark_workers(max_workers=int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    benchmark_rollout_batch_size()
+    benchmark_rollout_policies(workers=int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count())
+    benchmark_stratified_draws()
+    benchmark_tree_parallel()
+    benchmark_variants()
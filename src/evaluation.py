@@ -0,0 +1,33 @@
+import numpy as np
+
+import rollout_policy
+
+class StaticEvaluator():
+    '''
+    Estimates the chance that each player wins from a position without playing on, to cut rollouts short.
+
+    The expected final score of a player is the current score, plus, for the player whose turn it is,
+    the most points an action scores right now (see rollout_policy.capture_points).
+    The cards still in play (deck, hands and field) are expected to be split evenly, so they don't change who is ahead,
+    but they do make the lead less certain: the win probabilities are a softmax of the expected scores
+    with a temperature of temperature * sqrt(1 + cards still in play). A lower temperature trusts the lead more.
+    '''
+    def __init__(self, temperature=0.5):
+        self.temperature = temperature
+
+    def win_probabilities_batch(self, scores, hands, field, deck, whose_turn_, max_n_hand):
+        # for a batch of B positions: scores (B, n_players), hands (B, n_players, n_species), field and deck (B, n_species), whose_turn_ (B,)
+        batch_idx = np.arange(len(scores))
+        capture   = rollout_policy.capture_points(hands[batch_idx, whose_turn_], field, max_n_hand).max(axis=1)
+
+        expected = scores.astype(float)
+        expected[batch_idx, whose_turn_] += np.maximum(capture, 0)
+
+        in_play = deck.sum(axis=1) + hands.sum(axis=(1, 2)) + field.sum(axis=1)
+        logits  = expected / (self.temperature * np.sqrt(1 + in_play))[:, None]
+        p = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return p / p.sum(axis=1, keepdims=True)
+
+    def win_probabilities(self, game):
+        # the win probability of every player of a Kariba game, in the order of game.player_names
+        return self.win_probabilities_batch(game.scores_[None], game.hands_[None], game.field[None], game.deck[None], np.array([game.whose_turn_]), game.max_n_hand)[0]
@@ -0,0 +1,229 @@
+import copy
+import time
+import asyncio
+import argparse
+import functools
+import collections
+import concurrent.futures
+import numpy as np
+
+import kariba_moismcts
+import interactive_game
+import rollout_policy
+import util
+
+def search_move(game, n, time_budget_ms, seed, searcher_options):
+    # runs in a worker of the pool: one search from a snapshot of the game at a table
+    searcher = kariba_moismcts.Searcher(game, seed=seed, **searcher_options)
+    searcher.run(n=n, time_budget_ms=time_budget_ms)
+    return searcher.best_action(), searcher.n_simulations
+
+class MoveRequest():
+    def __init__(self, table_id, game, n, deadline, future):
+        self.table_id  = table_id
+        self.game      = game
+        self.n         = n
+        self.deadline  = deadline # on the time.monotonic() clock
+        self.future    = future
+        self.submitted = time.monotonic()
+        self.expired   = False # the table stopped waiting and played the fallback move
+
+class GameServer():
+    '''
+    Plays the AI side of many tables at once. The tables ask for moves with request_move, the scheduler (run) hands them to a shared pool of workers.
+
+    Scheduling is fair: every table has its own queue and the tables are served round robin, so one busy table can't starve the others.
+    At most max_in_flight searches run at the same time, so a request waits in its queue rather than in the pool
+    and its time budget is only set when a worker is free for it.
+
+    Every request has a deadline, deadline_ms after it was made. The search gets the time that is left minus margin_ms.
+    If no time is left, or the search doesn't come back in time, the table gets the move of the fallback policy instead.
+    '''
+    def __init__(self, executor, max_in_flight, n=500, deadline_ms=2000, margin_ms=50, seed=None, searcher_options={}, fallback_policy=None):
+        self.executor         = executor
+        self.max_in_flight    = max_in_flight
+        self.n                = n
+        self.deadline_ms      = deadline_ms
+        self.margin_ms        = margin_ms
+        self.searcher_options = searcher_options
+        self.fallback_policy  = rollout_policy.GreedyCapturePolicy() if fallback_policy is None else fallback_policy
+        self.seed_sequence    = np.random.SeedSequence(seed)
+
+        self.queues    = collections.OrderedDict() # table_id -> deque of MoveRequests, the table that was served last is at the end
+        self.wakeup    = asyncio.Event()
+        self.in_flight = 0
+
+        self.counters  = collections.Counter()
+        self.latencies = collections.defaultdict(list) # table_id -> seconds from request to move
+
+    def fallback_action(self, game):
+        return self.fallback_policy.select_action(game, game.whose_turn)
+
+    async def request_move(self, table_id, game, n=None, deadline_ms=None):
+        # the move of the player whose turn it is, searched on a snapshot of the game
+        deadline_ms = self.deadline_ms if deadline_ms is None else deadline_ms
+        request = MoveRequest(table_id, copy.deepcopy(game), self.n if n is None else n, time.monotonic() + deadline_ms / 1000, asyncio.get_running_loop().create_future())
+        self.queues.setdefault(table_id, collections.deque()).append(request)
+        self.wakeup.set()
+
+        try:
+            action = await asyncio.wait_for(asyncio.shield(request.future), timeout=max(0.0, request.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            request.expired = True
+            self.counters["deadlines_missed"] += 1
+            action = self.fallback_action(request.game)
+        self.latencies[table_id].append(time.monotonic() - request.submitted)
+        return action
+
+    def close_table(self, table_id):
+        self.queues.pop(table_id, None)
+
+    def next_request(self):
+        # round robin: the first table in line with a waiting request is served and goes to the back of the line
+        for table_id, queue in self.queues.items():
+            if len(queue) > 0:
+                self.queues.move_to_end(table_id)
+                return queue.popleft()
+        return None
+
+    def dispatch(self, request):
+        time_budget_ms = (request.deadline - time.monotonic()) * 1000 - self.margin_ms
+        if time_budget_ms <= 0:
+            self.counters["fallbacks"] += 1
+            request.future.set_result(self.fallback_action(request.game))
+            return
+        self.in_flight += 1
+        self.counters["searches"] += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, search_move, request.game, request.n, time_budget_ms, self.seed_sequence.spawn(1)[0], self.searcher_options)
+        future.add_done_callback(functools.partial(self.search_done, request))
+
+    def search_done(self, request, future):
+        self.in_flight -= 1
+        self.wakeup.set()
+        if request.expired or request.future.done():
+            return
+        if future.exception() is not None:
+            request.future.set_exception(future.exception())
+            return
+        action, n_simulations = future.result()
+        self.counters["simulations"] += n_simulations
+        request.future.set_result(action)
+
+    async def run(self):
+        # the scheduler, run it as a task next to the tables and cancel it when they are done
+        while True:
+            request = self.next_request() if self.in_flight < self.max_in_flight else None
+            if request is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            elif not request.expired:
+                self.dispatch(request)
+
+    def stats(self):
+        latencies = np.array([latency for table_latencies in self.latencies.values() for latency in table_latencies]) * 1000
+        return {
+            **self.counters,
+            "moves"                     : len(latencies),
+            "latency_ms_p50"            : float(np.percentile(latencies, 50)) if len(latencies) > 0 else None,
+            "latency_ms_p99"            : float(np.percentile(latencies, 99)) if len(latencies) > 0 else None,
+            "latency_ms_max_table_mean" : max(1000 * float(np.mean(table_latencies)) for table_latencies in self.latencies.values()) if len(latencies) > 0 else None
+        }
+
+async def play_table(server, table_id, client, n=500, show_deck=True, show_opponent_hand=False, seed=None):
+    '''
+    One game between a client and the AI of the server. The rules and the texts are those of InteractiveKaribaGame,
+    only the input and output go through the client (send and receive) and the AI moves through server.request_move.
+    Returns the final scoreboard
+    '''
+    game_seed, ai_seed = util.spawn_seeds(seed, 2)
+    game_rng = util.make_rng(game_seed)
+    kariba   = kariba_moismcts.Kariba(player_names=[client.name, "Monty Carlos"], whose_turn_=int(game_rng.integers(2)), rng=game_rng)
+    table    = interactive_game.InteractiveKaribaGame(kariba, show_deck, show_opponent_hand, n=n, seed=ai_seed)
+    client.join(table)
+
+    await client.send("Very well! " + kariba.whose_turn + " may begin!\n")
+    while not kariba.is_final:
+        await client.send(table.apply_event(kariba.random_card_draw()))
+
+        if kariba.whose_turn == table.human_name:
+            await client.send(table.state_str())
+            action, messages = table.human_action(await client.receive("What's your move?"))
+            while action is None:
+                for message in messages:
+                    await client.send(message)
+                await client.send("Erm. That's not a valid move")
+                action, messages = table.human_action(await client.receive("What's your move?"))
+            for message in messages:
+                await client.send(message)
+        else:
+            action = await server.request_move(table_id, kariba, n=table.n)
+
+        await client.send(table.apply_event(action))
+        kariba.next_turn()
+
+    await client.send(table.state_str())
+    await client.send(kariba.leading_player + " won!")
+    server.close_table(table_id)
+    return dict(kariba.scoreboard)
+
+class LocalClient():
+    '''
+    An in-process stand-in for a human at a remote table. It answers every prompt with a random allowed move, typed like "2 zebras",
+    after think_ms milliseconds, and with probability mistake_rate with a move that isn't allowed. Whatever the table sends is kept in transcript
+    '''
+    def __init__(self, name, seed=None, think_ms=0, mistake_rate=0.0):
+        self.name         = name
+        self.rng          = util.make_rng(seed)
+        self.think_ms     = think_ms
+        self.mistake_rate = mistake_rate
+        self.transcript   = []
+        self.table        = None
+
+    def join(self, table):
+        # a remote client would read the state from the texts, the stand-in looks at the table directly
+        self.table = table
+
+    async def send(self, text):
+        self.transcript.append(text)
+
+    async def receive(self, prompt):
+        self.transcript.append(prompt)
+        await asyncio.sleep(self.think_ms / 1000)
+        if self.rng.random() < self.mistake_rate:
+            return "{} elephants".format(self.table.kariba.max_n_hand + 1)
+        cards   = self.table.kariba.action_event(self.name, self.rng.choice(self.table.kariba.legal_action_ids(self.name)))["cards"]
+        species = int(np.flatnonzero(cards)[0])
+        return "{} {}".format(cards[species], self.table.animal_names[species][0 if cards[species] == 1 else 1])
+
+async def serve_local_tables(n_tables=8, workers=1, n=200, deadline_ms=1000, think_ms=0, seed=0, searcher_options={}):
+    '''
+    Plays n_tables games at once against LocalClients and returns the scoreboards and the stats of the server
+    '''
+    table_seeds  = util.spawn_seeds(seed, n_tables)
+    client_seeds = util.spawn_seeds(seed + 1, n_tables)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        server    = GameServer(executor, max_in_flight=workers, n=n, deadline_ms=deadline_ms, seed=seed, searcher_options=searcher_options)
+        scheduler = asyncio.create_task(server.run())
+        clients   = [LocalClient("table{}".format(i), seed=client_seeds[i], think_ms=think_ms, mistake_rate=0.05) for i in range(n_tables)]
+        try:
+            scoreboards = await asyncio.gather(*[play_table(server, i, clients[i], n=n, seed=table_seeds[i]) for i in range(n_tables)])
+        finally:
+            scheduler.cancel()
+    return scoreboards, server.stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Many tables of Kariba against local stand-in clients, served by one pool of workers")
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--n", type=int, default=200, help="simulations per AI move, if the deadline allows")
+    parser.add_argument("--deadline-ms", type=int, default=1000)
+    parser.add_argument("--think-ms", type=int, default=0, help="how long the stand-in clients take per move")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scoreboards, stats = asyncio.run(serve_local_tables(n_tables=args.tables, workers=args.workers, n=args.n, deadline_ms=args.deadline_ms, think_ms=args.think_ms, seed=args.seed))
+    for scoreboard in scoreboards:
+        print(scoreboard)
+    print(stats)
+    print("{:.1f} s".format(time.perf_counter() - start))
@@ -0,0 +1,63 @@
+import collections
+
+class Instrumentation():
+    '''
+    Opt-in timers and counters for the search loop of MOISMCTS.
+
+    Pass an instance to Simulators, Searcher or moismcts to switch it on. Without one, the search only checks once per simulation whether it is instrumented.
+
+    Phases (seconds):
+        card_draw       sampling the cards that are dealt
+        selection       choosing actions while a tree is still searching (UCB and expansion of untried actions)
+        tree_update     applying events to the game and the trees, including looking up and creating nodes
+        rollout         choosing actions once every tree is on the rollout policy, or the batch rollouts of batch_rollout
+        evaluation      estimating the win probabilities when a rollout is cut off at the rollout_depth
+        backpropagation updating the statistics of the visited nodes
+        reset           rewinding the game to the root state
+
+    Counters:
+        simulations, node_lookups (information set lookups in a tree), nodes_created,
+        selection_depth and rollout_depth (turns played before and after every tree switched to the rollout policy), batch_rollouts, cutoffs
+
+    Every hook is called as hook(instrumentation, simulators) after every simulation, e.g. to export the metrics periodically.
+    '''
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.reset()
+
+    def reset(self):
+        self.seconds    = collections.defaultdict(float)
+        self.counters   = collections.defaultdict(int)
+        self.tree_sizes = {}
+
+    def add_time(self, phase, seconds):
+        self.seconds[phase] += seconds
+
+    def count(self, counter, k=1):
+        self.counters[counter] += k
+
+    def end_simulation(self, simulators):
+        self.counters["simulations"] += 1
+        self.tree_sizes = {player : tree.n_nodes for player, tree in simulators.tree_dict.items()}
+        for hook in self.hooks:
+            hook(self, simulators)
+
+    def merge(self, metrics):
+        # add the metrics of another instrumented search, like one of the workers of a root-parallel search
+        for phase, seconds in metrics["seconds"].items():
+            self.seconds[phase] += seconds
+        for counter, k in metrics["counters"].items():
+            self.counters[counter] += k
+        for player, n_nodes in metrics["tree_sizes"].items():
+            self.tree_sizes[player] = self.tree_sizes.get(player, 0) + n_nodes
+
+    def metrics(self):
+        # a plain dictionary that can be sent between processes or dumped as json
+        n_simulations = max(1, self.counters["simulations"])
+        return {
+            "seconds"              : dict(self.seconds),
+            "counters"             : dict(self.counters),
+            "tree_sizes"           : dict(self.tree_sizes),
+            "mean_selection_depth" : self.counters["selection_depth"] / n_simulations,
+            "mean_rollout_depth"   : self.counters["rollout_depth"] / n_simulations
+        }
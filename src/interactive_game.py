@@ -1,34 +1,65 @@
 import time
 import copy
 import numpy as np
-import IPython.display as ipd
 
 import kariba_moismcts
 import util
 
+def animal_names(n_species):
+    '''
+    (singular, plural) names of n_species species, from the weakest to the strongest. The 8 species of the board game,
+    with up to 8 more species added below the elephant (the mice still chase away the strongest species).
+    No name is part of another, so they can be told apart in what a human types
+    '''
+    names = [
+        ("mouse", "mice"),
+        ("meerkat", "meerkats"),
+        ("zebra", "zebras"),
+        ("giraffe", "giraffes"),
+        ("ostrich", "ostriches"),
+        ("leopard", "leopards"),
+        ("rhino", "rhinos")
+    ]
+    extra_names = [
+        ("buffalo", "buffaloes"),
+        ("lion", "lions"),
+        ("crocodile", "crocodiles"),
+        ("hippo", "hippos"),
+        ("hyena", "hyenas"),
+        ("cheetah", "cheetahs"),
+        ("gorilla", "gorillas"),
+        ("antelope", "antelopes")
+    ]
+    if n_species > len(names) + len(extra_names) + 1:
+        raise ValueError("there are animal names for at most {} species".format(len(names) + len(extra_names) + 1))
+    names += extra_names[:max(0, n_species-8)]
+    return names[:n_species-1] + [("elephant", "elephants")]
+
 class InteractiveKaribaGame():
-    def __init__(self, kariba, show_deck, show_opponent_hand, n=500, indent_spaces=4):
+    def __init__(self, kariba, show_deck, show_opponent_hand, n=500, reuse_tree=False, seed=None, opening_book=None, indent_spaces=4):
         self.kariba = kariba
         self.human_name = kariba.player_names[0]
-        self.ai_name = kariba.player_names[1]
+        self.ai_names = kariba.player_names[1:] # every other player is played by the AI
+        self.ai_name = self.ai_names[0]
 
         self.n = n
 
+        # with reuse_tree=True the AI keeps its search trees between moves instead of starting from scratch each move
+        self.reuse_tree = reuse_tree
+        self.searcher   = None
+
+        # an opening_book.OpeningBook makes the first moves of the AI (nearly) instant
+        self.opening_book = opening_book
+
+        # the AI's searches and the emojis draw from this generator, the card draws from the generator of the kariba game
+        self.rng = util.make_rng(seed)
+
         self.show_deck = show_deck
         self.show_opponent_hand = show_opponent_hand
         self.indent_spaces = indent_spaces
 
         self.n_species = self.kariba.n_species
-        self.animal_names = [
-            ("mouse", "mice"),
-            ("meerkat", "meerkats"),
-            ("zebra", "zebras"),
-            ("giraffe", "giraffes"),
-            ("ostrich", "ostriches"),
-            ("leopard", "leopards"),
-            ("rhino", "rhinos"),
-            ("elephant", "elephants")
-        ]
+        self.animal_names = animal_names(self.n_species)
         self.animal_str_to_idx = {self.animal_names[i][j] : i for i in range(self.n_species) for j in range(2)} # call animal_str_to_idx["zebra"] for 2
         self.animal_idx_to_str = {i : {"singular" : self.animal_names[i][0], "plural" : self.animal_names[i][1]} for i in range(self.n_species)} # call animal_idx_to_str[6]["plural"] for "leopards"
 
@@ -64,140 +95,174 @@ class InteractiveKaribaGame():
             return "\n".join([str(arr[i]) + " " + (self.animal_idx_to_str[i]["singular"] if arr[i] == 1 else self.animal_idx_to_str[i]["plural"]) for i in reversed(range(len(arr))) if arr[i] > 0])
 
     def action_str_to_arr(self, s):
+        # the cards of what a human typed, and the notices about what was ignored or assumed in it
+        messages = []
         try:
             s = s.replace(" ","").lower() # remove whitespace and case-invariant
             if s.isdigit() and len(s) == self.n_species: # if typed like 00030000 for '3 giraffes'
                 action = np.array([int(c) for c in s], dtype=int) # change to array
             if "*" in s: # if typed like 3*4 for '3 giraffes'
-                n = int(s[0])
-                animal_idx = int(s[2])
+                n, animal_idx = [int(part) for part in s.split("*")]
                 action = n*util.one_hot(animal_idx, n_dim=self.n_species)
             else:
                 animal_idx = [i for i in range(self.n_species) if any([word in s for word in self.animal_names[i]])]
                 if len(animal_idx) >= 2:
-                    print("you submitted more than 1 animal, we'll ignore that and just select the first")
+                    messages.append("you submitted more than 1 animal, we'll ignore that and just select the first")
                 animal_idx = animal_idx[0]
                 n = [int(c) for c in s if c.isdigit()]
                 if len(n) > 1:
-                    print("you submitted more than 1 number, we'll ignore that and just select the first")
+                    messages.append("you submitted more than 1 number, we'll ignore that and just select the first")
                 if len(n) == 0:
-                    print("you submitted no number. We'll assume you meant to play a single card")
+                    messages.append("you submitted no number. We'll assume you meant to play a single card")
                     n = [1]
                 n = n[0]
                 action = n*util.one_hot(animal_idx, n_dim=self.n_species)
         except:
             action = np.zeros(self.n_species)
-        return action
+        return action, messages
+
+    def human_action(self, s):
+        # the action event of what a human typed, None if it's not a valid move, and the notices of action_str_to_arr
+        cards, messages = self.action_str_to_arr(s)
+        action_id = self.kariba.action_id(cards)
+        if action_id is not None and self.kariba.legal_action_mask(self.human_name)[action_id]:
+            return self.kariba.action_event(self.human_name, action_id), messages
+        return None, messages
 
     def get_action_from_human(self):
         time.sleep(1)
-        cards = self.action_str_to_arr(input("What's your move?"))
-        if any([np.array_equal(cards, allowed_action["cards"]) for allowed_action in self.kariba.allowed_actions(self.human_name)]):
-            event = {
-                "kind"  : "action",
-                "who"   : self.human_name,
-                "cards" : cards
-            }
-            return event
-        else:
+        action, messages = self.human_action(input("What's your move?"))
+        for message in messages:
+            print(message)
+        if action is None:
             print("Erm. That's not a valid move")
             return self.get_action_from_human() # recursion!
+        return action
 
-    def show_state(self):
-        print("********************************************************")
-        print("Scoreboard:")
-        print(util.indent_string("\n".join([player.ljust(max([len(name) for name in self.kariba.player_names]))+" : "+str(score) for player, score in self.kariba.scoreboard.items()]), indent_spaces=self.indent_spaces))
-        print("")
+    def state_str(self):
+        # the text of show_state, it's up to the caller to print it or send it somewhere
+        lines = []
+        lines.append("********************************************************")
+        lines.append("Scoreboard:")
+        lines.append(util.indent_string("\n".join([player.ljust(max([len(name) for name in self.kariba.player_names]))+" : "+str(score) for player, score in self.kariba.scoreboard.items()]), indent_spaces=self.indent_spaces))
+        lines.append("")
 
         if self.show_deck and self.show_opponent_hand:
-            print("The deck holds:")
-            print(util.indent_string(self.animals_arr_to_str(self.kariba.deck), indent_spaces=self.indent_spaces))
+            lines.append("The deck holds:")
+            lines.append(util.indent_string(self.animals_arr_to_str(self.kariba.deck), indent_spaces=self.indent_spaces))
         elif self.show_deck and not self.show_opponent_hand:
-            print("The 'jungle' (the jungle is the union of the deck and the opponent's hand) holds:")
-            print(util.indent_string(self.animals_arr_to_str(self.kariba.jungle(self.human_name)), indent_spaces=self.indent_spaces))
-        print("")
+            lines.append("The 'jungle' (the jungle is the union of the deck and the opponents' hands) holds:")
+            lines.append(util.indent_string(self.animals_arr_to_str(self.kariba.jungle(self.human_name)), indent_spaces=self.indent_spaces))
+        lines.append("")
 
-        print("On the field lies:")
-        print(util.indent_string(self.animals_arr_to_str(self.kariba.field), indent_spaces=self.indent_spaces))
-        print("")
+        lines.append("On the field lies:")
+        lines.append(util.indent_string(self.animals_arr_to_str(self.kariba.field), indent_spaces=self.indent_spaces))
+        lines.append("")
 
         if self.show_opponent_hand:
-            print(self.ai_name+"'s hand holds:")
-            print(util.indent_string(self.animals_arr_to_str(self.kariba.hands[self.ai_name]), indent_spaces=self.indent_spaces))
-            print("")
+            for ai_name in self.ai_names:
+                lines.append(ai_name+"'s hand holds:")
+                lines.append(util.indent_string(self.animals_arr_to_str(self.kariba.hand(ai_name)), indent_spaces=self.indent_spaces))
+                lines.append("")
 
-        print(self.human_name+"'s hand holds:")
-        print(util.indent_string(self.animals_arr_to_str(self.kariba.hands[self.human_name]), indent_spaces=self.indent_spaces))
-        print("")
+        lines.append(self.human_name+"'s hand holds:")
+        lines.append(util.indent_string(self.animals_arr_to_str(self.kariba.hand(self.human_name)), indent_spaces=self.indent_spaces))
+        lines.append("")
+        return "\n".join(lines)
 
-    def process_event(self, event):
-
-        print("--------------------------------------------------------")
+    def show_state(self):
+        print(self.state_str())
 
+    def apply_event(self, event):
+        # apply the event to the game and return the text that tells the human what happened
         state_before_event = copy.deepcopy(self.kariba)
         self.kariba.apply_event(event)
 
+        lines = []
         if event["kind"] == "deck_draw":
             if event["who"] == self.human_name:
-                print(self.human_name, "drew the following card"+("s" if np.sum(event["cards"])>1 else "")+":")
-                print(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
-            if event["who"] == self.ai_name:
+                lines.append(self.human_name+" drew the following card"+("s" if np.sum(event["cards"])>1 else "")+":")
+                lines.append(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
+            if event["who"] in self.ai_names:
                 if self.show_opponent_hand:
-                    print(self.ai_name, "drew the following card"+("s" if np.sum(event["cards"])>1 else "")+":")
-                    print(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
+                    lines.append(event["who"]+" drew the following card"+("s" if np.sum(event["cards"])>1 else "")+":")
+                    lines.append(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
                 else:
-                    print(self.ai_name, "drew new cards.")
+                    lines.append(event["who"]+" drew new cards.")
 
         if event["kind"] == "action":
-            print(event["who"], "played:")
-            print(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
+            lines.append(event["who"]+" played:")
+            lines.append(util.indent_string(self.animals_arr_to_str(event["cards"]), indent_spaces=self.indent_spaces))
             score_gained = self.kariba.scoreboard[event["who"]] - state_before_event.scoreboard[event["who"]]
             if score_gained > 0:
                 change = state_before_event.field - self.kariba.field
                 chaser = (change<0)*self.kariba.field
                 chasee = (change>0)*state_before_event.field
 
-                print("")
-                print("!!!")
-                print( "The", self.animals_arr_to_str(chaser).replace("\n", ""), "chased away the ", self.animals_arr_to_str(chasee).replace("\n", ""), "!" )
-                print( event["who"]+" scored "+str(score_gained)+" point"+("s" if score_gained > 1 else ""), np.random.choice(self.text_emojis_bad) if event["who"] == self.ai_name else np.random.choice(self.text_emojis_good))
-                print("!!!")
+                lines.append("")
+                lines.append("!!!")
+                lines.append("The "+self.animals_arr_to_str(chaser).replace("\n", "")+" chased away the  "+self.animals_arr_to_str(chasee).replace("\n", "")+" !")
+                lines.append(event["who"]+" scored "+str(score_gained)+" point"+("s" if score_gained > 1 else "")+" "+(self.rng.choice(self.text_emojis_bad) if event["who"] in self.ai_names else self.rng.choice(self.text_emojis_good)))
+                lines.append("!!!")
+
+        lines.append("")
+        return "\n".join(lines)
 
-        print("")
+    def process_event(self, event):
+        print("--------------------------------------------------------")
+        print(self.apply_event(event))
+
+    def search_seed(self):
+        return int(self.rng.integers(2**63))
+
+    def get_action_from_ai(self):
+        if not self.reuse_tree:
+            return kariba_moismcts.moismcts(copy.deepcopy(self.kariba), n=self.n, seed=self.search_seed(), opening_book=self.opening_book)
+        if self.searcher is None:
+            self.searcher = kariba_moismcts.Searcher(self.kariba, seed=self.search_seed(), opening_book=self.opening_book)
+        self.searcher.run(n=self.n, progress_bar=True)
+        return self.searcher.best_action()
 
     def play_game(self):
         while not self.kariba.is_final:
             random_card_draw = self.kariba.random_card_draw()
             self.process_event(random_card_draw)
+            if self.searcher is not None:
+                self.searcher.advance(random_card_draw)
 
             if self.kariba.whose_turn == self.human_name:
                 self.show_state()
                 action = self.get_action_from_human()
-                # ipd.clear_output()
 
-            if self.kariba.whose_turn == self.ai_name:
-                print(self.ai_name, "is planning its next move...")
+            if self.kariba.whose_turn in self.ai_names:
+                print(self.kariba.whose_turn, "is planning its next move...")
                 time.sleep(1)
-                action = kariba_moismcts.moismcts(copy.deepcopy(self.kariba), n=self.n)
+                action = self.get_action_from_ai()
 
             self.process_event(action)
             self.kariba.next_turn()
+            if self.searcher is not None:
+                self.searcher.advance(action)
+                self.searcher.next_turn()
 
         self.show_state()
         print(self.kariba.leading_player, " won!")
 
-def interactive_game(n=500):
+def interactive_game(n=500, seed=None, opening_book=None, n_opponents=1, n_species=8):
     human_name         = input("Okay Human! what is your name? ")
     show_opponent_hand = util.str_to_bool(input("Do you want the AI's cards to be visible to you? (y/n)"))
     show_deck          = util.str_to_bool(input("Do you want the contents of the deck to be visible to you? (y/n)"))
 
-    ai_name      = "Monty Carlos"
-    player_names = [human_name, ai_name]
+    ai_names     = ["Monty Carlos"] + ["Monty Carlos " + "I"*(i+2) for i in range(n_opponents-1)]
+    player_names = [human_name, *ai_names]
+
+    game_seed, ai_seed = util.spawn_seeds(seed, 2)
+    game_rng = util.make_rng(game_seed)
 
-    print("Okay, let's flip a coin to see who may begin the game")
-    whose_turn_ = np.random.randint(2)
+    print("Okay, let's flip a coin to see who may begin the game" if n_opponents == 1 else "Okay, let's roll a die to see who may begin the game")
+    whose_turn_ = int(game_rng.integers(len(player_names)))
     print("Very well! ", player_names[whose_turn_], " may begin! \n")
 
-    interactive_game = InteractiveKaribaGame(kariba_moismcts.Kariba(player_names = player_names, whose_turn_ = whose_turn_), show_deck, show_opponent_hand, n=n)
+    interactive_game = InteractiveKaribaGame(kariba_moismcts.Kariba(player_names = player_names, whose_turn_ = whose_turn_, n_species = n_species, rng = game_rng), show_deck, show_opponent_hand, n=n, seed=ai_seed, opening_book=opening_book)
 
     interactive_game.play_game()
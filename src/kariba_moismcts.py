@@ -1,25 +1,95 @@
 import sys
+import math
+import time
 import copy
+import types
 import numpy as np
-import random
 import itertools
 import tqdm
+import functools
+import threading
+import concurrent.futures
 
 import util
+import batch_rollout
+import rollout_policy as rollout_policy_
+import evaluation
+import instrumentation as instrumentation_
+
+@functools.lru_cache(maxsize=None)
+def action_table(n_species, max_n_hand):
+    '''
+    Every action there can be, as an array of shape (n_species*max_n_hand, n_species).
+    Row action_id holds the cards of playing action_id % max_n_hand + 1 animals of species action_id // max_n_hand.
+    The table is shared, so it is made read-only
+    '''
+    species = np.repeat(np.arange(n_species), max_n_hand)
+    counts  = np.tile(np.arange(1, max_n_hand+1), n_species)
+    table   = counts[:, None] * np.eye(n_species, dtype=int)[species]
+    table.flags.writeable = False
+    return table
+
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2 # the step of the stratified card draws, its multiples modulo 1 spread out as evenly as any sequence can
+
+def n_draw_outcomes(deck, n_to_draw):
+    # an upper bound on the number of distinct draws of n_to_draw cards from deck, without enumerating them
+    n_species_left = int(np.count_nonzero(deck))
+    return math.comb(n_to_draw + n_species_left - 1, n_species_left - 1) if n_species_left > 0 else 1
+
+@functools.lru_cache(maxsize=4096)
+def draw_outcomes(deck, n_to_draw):
+    '''
+    Every distinct draw of n_to_draw cards from deck (a tuple of counts per species) and its multivariate hypergeometric probability,
+    as arrays of shape (n_outcomes, n_species) and (n_outcomes,). Cached per (deck, n_to_draw) and made read-only, like action_table
+    '''
+    outcomes = [()]
+    for species, n_in_deck in enumerate(deck):
+        n_left_after = sum(deck[species+1:]) # the cards of the species after this one have to be able to make up the rest of the draw
+        outcomes = [outcome + (k,) for outcome in outcomes for k in range(min(n_in_deck, n_to_draw - sum(outcome)) + 1) if n_to_draw - sum(outcome) - k <= n_left_after]
+    outcomes      = np.array(outcomes, dtype=int).reshape(-1, len(deck))
+    probabilities = np.array([math.prod(math.comb(n, k) for n, k in zip(deck, outcome)) for outcome in outcomes.tolist()]) / math.comb(sum(deck), n_to_draw)
+    outcomes.flags.writeable      = False
+    probabilities.flags.writeable = False
+    return outcomes, probabilities
 
 class Kariba():
-    def __init__(self, deck=None, field=None, hands=None, whose_turn_=0, player_names=["player0","player1"], n_species=8, max_n_hand=5):
+    # the state lives in a handful of fixed-size integer arrays rather than dicts, so that simulations can apply and undo events in place instead of deep-copying the game
+    __slots__ = ("n_species", "max_n_hand", "whose_turn_", "player_names", "n_players", "player_idx", "deck", "field", "hands_", "scores_", "history", "rng")
+
+    def __init__(self, deck=None, field=None, hands=None, whose_turn_=0, player_names=["player0","player1"], n_species=8, max_n_hand=5, rng=None, cards_per_species=None):
         self.n_species = n_species
         self.max_n_hand = max_n_hand
 
         self.whose_turn_  = whose_turn_
         self.player_names = player_names
         self.n_players    = len(player_names)
+        self.player_idx   = {player : i for i, player in enumerate(self.player_names)}
+
+        cards_per_species = max(3, self.n_species) if cards_per_species is None else cards_per_species # the deck of the board game has 8 cards of each of its 8 species
+        self.deck    = np.ones(self.n_species, dtype=int) * cards_per_species if deck is None else np.array(deck, dtype=int)
+        self.field   = np.zeros(self.n_species, dtype=int) if field is None else np.array(field, dtype=int)
+        self.hands_  = np.zeros((self.n_players, self.n_species), dtype=int) # one row per player, in the order of player_names
+        self.scores_ = np.zeros(self.n_players, dtype=int)
+        if hands is not None:
+            for player, hand in hands.items():
+                self.hands_[self.player_idx[player]] = hand
+
+        # every applied event is recorded together with what is needed to reverse it, see undo_event
+        self.history = []
 
-        self.deck       = np.ones(self.n_species, dtype=int) * max(3, self.n_species) if deck is None else deck
-        self.field      = np.zeros(self.n_species, dtype=int)
-        self.hands      = {player : np.zeros(self.n_species, dtype=int) for player in self.player_names}
-        self.scoreboard = {player : 0 for player in self.player_names}
+        # all randomness of the game (the card draws) comes from this numpy.random.Generator, see util.make_rng
+        self.rng = util.make_rng() if rng is None else rng
+
+    @property
+    def hands(self):
+        # built from hands_ on every access, so it is read-only: hands[player] = cards raises a TypeError instead of being lost.
+        # The rows are views, so in-place changes like hands[player] += cards still end up in the game
+        return types.MappingProxyType({player : self.hands_[i] for i, player in enumerate(self.player_names)})
+
+    @property
+    def scoreboard(self):
+        # read-only like hands, scoreboard[player] += points raises a TypeError. Change scores_ instead
+        return types.MappingProxyType({player : int(self.scores_[i]) for i, player in enumerate(self.player_names)})
 
     @property
     def whose_turn(self):
@@ -31,117 +101,544 @@ class Kariba():
 
     @property
     def is_final(self):
-        return np.sum(self.deck) == 0 and (any([np.sum(self.hands[player])==0 for player in self.player_names]))
+        return self.deck.sum() == 0 and not self.hands_.sum(axis=1).all()
 
     @property
     def leading_player(self):
-        return util.keywithmaxval(self.scoreboard)
+        return self.player_names[int(np.argmax(self.scores_))] # argmax picks the first player among equals, like util.keywithmaxval
 
     def next_turn(self):
         self.whose_turn_ = self.who_next_turn_
 
+    @classmethod
+    def variant(cls, n_players=2, n_species=8, cards_per_species=None, max_n_hand=5, whose_turn_=0, rng=None):
+        # a new game for n_players players named player0, player1, ..., e.g. Kariba.variant(4, 12) for 4 players and 12 species
+        return cls(whose_turn_=whose_turn_, player_names=["player{}".format(i) for i in range(n_players)], n_species=n_species, max_n_hand=max_n_hand, rng=rng, cards_per_species=cards_per_species)
+
+    def snapshot(self, rng=None):
+        # a copy of the state without the history, e.g. to send to another process
+        game = Kariba(self.deck, self.field, None, self.whose_turn_, self.player_names, self.n_species, self.max_n_hand, rng)
+        game.hands_[:]  = self.hands_
+        game.scores_[:] = self.scores_
+        return game
+
+    def hand(self, player):
+        return self.hands_[self.player_idx[player]]
+
     def jungle(self, player):
-        return sum([self.deck] + [hand for player_, hand in self.hands.items() if player_ != player])
+        jungle = self.deck + self.hands_.sum(axis=0)
+        if player in self.player_idx:
+            jungle -= self.hands_[self.player_idx[player]]
+        return jungle
 
     def apply_event(self, event):
+        who_  = self.player_idx[event["who"]]
+        cards = event["cards"]
+
+        # we use fear_animal=-1 to denote a situation where there's no animals to be chased away
+        fear_animal, n_chased = -1, 0
+
         if event["kind"] == "deck_draw":
-            self.deck                -= event["cards"]
-            self.hands[event["who"]] += event["cards"]
+            self.deck        -= cards
+            self.hands_[who_] += cards
 
         if event["kind"] == "action":
-            self.hands[event["who"]] -= event["cards"]
-            self.field               += event["cards"]
+            self.hands_[who_] -= cards
+            self.field        += cards
 
-            action_animal = np.nonzero(event["cards"])[0][0]
+            action_animal = event["action_id"] // self.max_n_hand if "action_id" in event else np.flatnonzero(cards)[0]
             if self.field[action_animal] >= 3:
-                # we use fear_animal=-1 to denote a situation where there's no animals to be chased away
-                fear_animal = self.n_species - 1 if action_animal == 0 else max([idx for idx in self.field.nonzero()[0] if idx < action_animal] + [-1])
+                if action_animal == 0:
+                    fear_animal = self.n_species - 1
+                else:
+                    weaker_animals = np.flatnonzero(self.field[:action_animal])
+                    fear_animal = weaker_animals[-1] if len(weaker_animals) > 0 else -1
                 if fear_animal >= 0:
-                    self.scoreboard[self.whose_turn] += self.field[fear_animal]
+                    n_chased = self.field[fear_animal]
+                    self.scores_[self.whose_turn_] += n_chased
                     self.field[fear_animal] = 0
 
-    def allowed_actions(self, player):
-        hand = self.hands[player]
-        cards_list = [n*util.one_hot(idx, n_dim=self.n_species) for idx in range(self.n_species) for n in range(1, int(self.hands[player][idx])+1)]
-        event_list = [{
-            "kind"  : "action",
-            "who"   : player,
-            "cards" : cards
-        } for cards in cards_list]
-        return event_list
+        self.history.append((event, self.whose_turn_, fear_animal, n_chased))
 
-    def random_card_draw(self):
-        n_hand = np.sum(self.hands[self.whose_turn])
-        n_to_draw = min(self.max_n_hand - n_hand, np.sum(self.deck))
+    def undo_event(self):
+        # reverse the most recently applied event, including any turns that have passed since
+        event, whose_turn_, fear_animal, n_chased = self.history.pop()
+        who_  = self.player_idx[event["who"]]
+        cards = event["cards"]
+
+        self.whose_turn_ = whose_turn_
 
-        cards = np.zeros(self.n_species, dtype=int)
-        for _ in range(n_to_draw):
-            cards += util.one_hot(np.random.choice(range(self.n_species), p=(self.deck-cards) / np.sum(self.deck-cards)), n_dim=self.n_species)
+        if event["kind"] == "deck_draw":
+            self.deck        += cards
+            self.hands_[who_] -= cards
+
+        if event["kind"] == "action":
+            if fear_animal >= 0:
+                self.field[fear_animal] = n_chased
+                self.scores_[whose_turn_] -= n_chased
+            self.field        -= cards
+            self.hands_[who_] += cards
 
+        return event
+
+    def rewind(self, history_length=0):
+        # undo events until only the first history_length events remain applied
+        while len(self.history) > history_length:
+            self.undo_event()
+
+    def legal_action_mask(self, player):
+        # a boolean mask over the rows of action_table(n_species, max_n_hand)
+        return (self.hand(player)[:, None] >= np.arange(1, self.max_n_hand+1)[None, :]).ravel()
+
+    def legal_action_ids(self, player):
+        return np.flatnonzero(self.legal_action_mask(player))
+
+    def action_id(self, cards):
+        # the row of action_table that holds these cards, None if the cards are not a single species
+        species = np.flatnonzero(cards)
+        if len(species) != 1 or not 1 <= cards[species[0]] <= self.max_n_hand:
+            return None
+        return int(species[0] * self.max_n_hand + cards[species[0]] - 1)
+
+    def action_event(self, player, action_id):
+        event = {
+            "kind"      : "action",
+            "who"       : player,
+            "cards"     : action_table(self.n_species, self.max_n_hand)[action_id],
+            "action_id" : int(action_id)
+        }
+        return event
+
+    def allowed_actions(self, player):
+        return [self.action_event(player, action_id) for action_id in self.legal_action_ids(player)]
+
+    @property
+    def n_to_draw(self):
+        # the player whose turn it is refills their hand, as far as the deck allows
+        return int(min(self.max_n_hand - self.hands_[self.whose_turn_].sum(), self.deck.sum()))
+
+    def card_draw_event(self, cards):
         event = {
             "kind"  : "deck_draw",
             "who"   : self.whose_turn,
             "cards" : cards
         }
-
         return event
 
+    def random_card_draw(self):
+        # drawing the cards one by one without replacement, in a single call
+        return self.card_draw_event(self.rng.multivariate_hypergeometric(self.deck, self.n_to_draw))
+
     def __repr__(self):
         s = \
         "-------------------------\n" + \
         "turn: " + self.whose_turn + "\n" + \
         "deck:\n" + str(self.deck) + "\n"+ \
         "field:\n" + str(self.field) + "\n" + \
-        "hands:\n"+"\n".join([name+" "+str(hand) for name, hand in self.hands.items()]) + "\n" + \
+        "hands:\n"+"\n".join([name+" "+str(hand) for name, hand in zip(self.player_names, self.hands_)]) + "\n" + \
         "-------------------------\n"
         return s
 
-def is_equivalent_node(node_a, node_b):
-    return all([                                                  \
-        node_a.player              == node_b.player,              \
-        node_a.is_post_action_node == node_a.is_post_action_node, \
-        np.array_equal(node_a.hand,   node_b.hand),               \
-        np.array_equal(node_a.field,  node_b.field),              \
-        np.array_equal(node_a.jungle, node_b.jungle)              \
-    ])
+def is_post_action_event(event, player):
+    return event is not None and event["kind"] == "action" and event["who"] == player
+
+def observation_key(game, player):
+    # everything the player can observe (own hand, field and jungle) packed into a hashable bytes object, one byte per count
+    return np.concatenate((game.hand(player), game.field, game.jungle(player))).astype(np.uint8).tobytes()
+
+def observation_keys(game):
+    # observation_key of every player at once, in the order of player_names. The jungles of all players are a single subtraction
+    hands   = game.hands_
+    jungles = (game.deck + hands.sum(axis=0)) - hands
+    return [row.tobytes() for row in np.concatenate((hands, np.broadcast_to(game.field, hands.shape), jungles), axis=1).astype(np.uint8)]
+
+def rollout_game(game, policy, max_depth=None, evaluator=None):
+    '''
+    Plays game on with the rollout policy from the start of a turn and returns the wins of each player, in the order of player_names.
+    With max_depth, the game is cut off after max_depth turns and the evaluator estimates who wins.
+    The single-game counterpart of batch_rollout.batch_wins, game is changed in place
+    '''
+    depth = 0
+    while not game.is_final:
+        if max_depth is not None and depth >= max_depth:
+            return evaluator.win_probabilities(game)
+        game.apply_event(game.random_card_draw())
+        game.apply_event(policy.select_action(game, game.whose_turn))
+        game.next_turn()
+        depth += 1
+    return np.eye(game.n_players)[game.player_idx[game.leading_player]]
+
+def rollout_games(game, n_games, policy, max_depth=None, evaluator=None):
+    # the wins of each player over n_games played on by rollout_game, one after the other. game is rewound after each of them
+    history_length = len(game.history)
+    wins = np.zeros(game.n_players)
+    for _ in range(n_games):
+        wins += rollout_game(game, policy, max_depth, evaluator)
+        game.rewind(history_length)
+    return wins
+
+class NodeStore():
+    '''
+    The nodes of one Tree, stored as a struct of arrays: node idx has n[idx] simulations, w[idx] wins, parent[idx], and so on.
+    w is a float, because a simulation that is cut off by an evaluator counts as a fraction of a win.
+    The edges from a node to its children form a linked list (first_edge, edge_next) in the order they were added,
+    every edge holds the action that leads from the parent to the child.
+
+    The only Python object per node is its packed key: the parent index, the post-action flag and the observation_key of the player.
+    The same bytes object serves to find a child in child_index and to recover the hand, field and jungle of the node.
+
+    With transpositions=True the key holds whose turn it is instead of the parent, so an information set that is reached along different paths
+    is a single node with several parents and the tree becomes a directed acyclic graph. parent[idx] is then the parent it was first reached from.
+    Without the parent the path no longer tells the scores apart, so the trees then add the scores to the observation (see Tree.observation).
+
+    With max_nodes set, the store evicts the leaves with the fewest simulations when it is full.
+    An evicted node is freed right away, the edges pointing to it are dropped the next time the edges of their parent are walked
+    (edge_generation no longer matches the generation of the node).
+
+    virtual_loss[idx] counts the simulations that passed through idx and whose result is still being computed (see Simulators.simulate_parallel).
+    They count as visits that were lost, so the descents that are made in the meantime spread out over other nodes, and nodes with a virtual loss are never evicted.
+    The results can come back in other threads: backpropagate and add_virtual_loss hold lock, and so does add while it grows the arrays
+    '''
+    def __init__(self, player, player_names, n_species, max_n_hand, c=np.sqrt(2), transpositions=False, max_nodes=None, capacity=1024):
+        self.player         = player
+        self.player_names   = player_names
+        self.n_species      = n_species
+        self.max_n_hand     = max_n_hand
+        self.c              = c # hyperparameter that determines the tradeoff between exploration and exploitation
+        self.transpositions = transpositions
+        self.max_nodes      = max_nodes
+
+        self.n_nodes   = 0 # nodes in use
+        self.n_created = 0 # nodes created since the start, including the evicted ones
+        self.top       = 0 # the slots below top have been used at some point
+        self.edge_top  = 0
+        self.free_nodes = []
+        self.free_edges = []
+
+        capacity = capacity if max_nodes is None else min(capacity, max_nodes)
+        self.n              = np.zeros(capacity, dtype=np.int64)
+        self.w              = np.zeros(capacity, dtype=np.float64)
+        self.virtual_loss   = np.zeros(capacity, dtype=np.int64)
+        self.parent         = np.zeros(capacity, dtype=np.int32)
+        self.first_edge     = np.zeros(capacity, dtype=np.int32)
+        self.last_edge      = np.zeros(capacity, dtype=np.int32)
+        self.is_post_action = np.zeros(capacity, dtype=bool)
+        self.whose_turn_    = np.zeros(capacity, dtype=np.int8)
+        self.action_id      = np.zeros(capacity, dtype=np.int32)
+        self.generation     = np.zeros(capacity, dtype=np.int32)
+        self.in_use         = np.zeros(capacity, dtype=bool)
+
+        self.edge_parent     = np.zeros(capacity, dtype=np.int32)
+        self.edge_child      = np.zeros(capacity, dtype=np.int32)
+        self.edge_generation = np.zeros(capacity, dtype=np.int32)
+        self.edge_next       = np.zeros(capacity, dtype=np.int32)
+        self.edge_action     = np.zeros(capacity, dtype=np.int32)
+        self.edge_in_use     = np.zeros(capacity, dtype=bool)
+
+        self.keys            = [] # per slot, None for a free slot
+        self.child_index     = {} # packed key -> idx
+        self.edge_index      = set() # (parent, child, generation of the child), only needed to link transpositions
+        self.untried_actions = {} # idx -> list of action ids, only for nodes that are being expanded
+        self.chance_visits   = {} # idx -> {deck : [offset, draws so far]}, only for stratified draws, see Tree.stratified_card_draw
+        self.lock            = threading.Lock()
+
+    node_arrays = ["n", "w", "virtual_loss", "parent", "first_edge", "last_edge", "is_post_action", "whose_turn_", "action_id", "generation", "in_use"]
+    edge_arrays = ["edge_parent", "edge_child", "edge_generation", "edge_next", "edge_action", "edge_in_use"]
+
+    def pack_key(self, parent, is_post_action, observation, whose_turn_):
+        prefix = int(whose_turn_) if self.transpositions else int(parent)
+        return prefix.to_bytes(4, "little", signed=True) + (b"\x01" if is_post_action else b"\x00") + observation
+
+    def observation(self, idx):
+        return self.keys[idx][5:]
+
+    def action(self, idx, action_id=None):
+        # the event of playing action_id, by default the action that first led to the post-action node idx
+        action_id = int(self.action_id[idx] if action_id is None else action_id)
+        event = {
+            "kind"      : "action",
+            "who"       : self.player,
+            "cards"     : action_table(self.n_species, self.max_n_hand)[action_id],
+            "action_id" : action_id
+        }
+        return event
+
+    def child(self, parent, is_post_action, observation, whose_turn_):
+        # the idx of the node with this information set below parent, -1 if there is none. With transpositions, it can be anywhere in the graph
+        return self.child_index.get(self.pack_key(parent, is_post_action, observation, whose_turn_), -1)
+
+    def add(self, parent, is_post_action, observation, whose_turn_, action_id=-1, protected=(), link=True):
+        # a new node, linked to parent if parent >= 0 and link=True. The nodes in protected (like the path of the current simulation) are never evicted to make room
+        if self.max_nodes is not None and self.n_nodes >= self.max_nodes:
+            self.evict(max(1, self.max_nodes // 10), protected=[parent, *protected])
+
+        if len(self.free_nodes) > 0:
+            idx = self.free_nodes.pop()
+        else:
+            if self.top == len(self.n):
+                with self.lock: # a backpropagation in another thread must not write to the arrays that are being replaced
+                    for name in self.node_arrays:
+                        setattr(self, name, np.resize(getattr(self, name), 2*self.top))
+            idx = self.top
+            self.top += 1
+            self.keys.append(None)
+        self.n_nodes   += 1
+        self.n_created += 1
+
+        key = self.pack_key(parent, is_post_action, observation, whose_turn_)
+        self.keys[idx] = key
+        self.child_index[key] = idx
+
+        self.n[idx]              = 0
+        self.w[idx]              = 0
+        self.virtual_loss[idx]   = 0
+        self.parent[idx]         = parent
+        self.first_edge[idx]     = -1
+        self.last_edge[idx]      = -1
+        self.is_post_action[idx] = is_post_action
+        self.whose_turn_[idx]    = whose_turn_
+        self.action_id[idx]      = action_id
+        self.in_use[idx]         = True
+
+        if parent >= 0 and link:
+            self.add_edge(parent, idx, action_id)
+        return idx
+
+    def add_edge(self, parent, child, action_id):
+        if len(self.free_edges) > 0:
+            edge = self.free_edges.pop()
+        else:
+            if self.edge_top == len(self.edge_child):
+                for name in self.edge_arrays:
+                    setattr(self, name, np.resize(getattr(self, name), 2*self.edge_top))
+            edge = self.edge_top
+            self.edge_top += 1
+
+        self.edge_parent[edge]     = parent
+        self.edge_child[edge]      = child
+        self.edge_generation[edge] = self.generation[child]
+        self.edge_next[edge]       = -1
+        self.edge_action[edge]     = action_id
+        self.edge_in_use[edge]     = True
+        if self.transpositions:
+            self.edge_index.add((int(parent), int(child), int(self.generation[child])))
+
+        if self.first_edge[parent] < 0:
+            self.first_edge[parent] = edge
+        else:
+            self.edge_next[self.last_edge[parent]] = edge
+        self.last_edge[parent] = edge
+
+    def link(self, parent, child, action_id):
+        # make sure a node that was reached through a transposition is a child of parent
+        if (int(parent), int(child), int(self.generation[child])) not in self.edge_index:
+            self.add_edge(parent, child, action_id)
+
+    def free_edge(self, edge):
+        self.edge_in_use[edge] = False
+        self.free_edges.append(edge)
+        if self.transpositions:
+            self.edge_index.discard((int(self.edge_parent[edge]), int(self.edge_child[edge]), int(self.edge_generation[edge])))
+
+    def edges(self, idx):
+        # the edges to the children of idx that are still in use, dropping the ones to evicted children on the way
+        edges, previous = [], -1
+        edge = self.first_edge[idx]
+        while edge >= 0:
+            next_edge = self.edge_next[edge]
+            if self.edge_generation[edge] == self.generation[self.edge_child[edge]]:
+                edges.append(edge)
+                previous = edge
+            else:
+                if previous < 0:
+                    self.first_edge[idx] = next_edge
+                else:
+                    self.edge_next[previous] = next_edge
+                if self.last_edge[idx] == edge:
+                    self.last_edge[idx] = previous
+                self.free_edge(edge)
+            edge = next_edge
+        return edges
+
+    def action_edges(self, idx):
+        # the edges to the post-action children of idx. With transpositions a decision node can also have a card-draw child:
+        # the key doesn't tell how the jungle is split between the deck and the opponents' hands, so the same node can be before the draw in one simulation
+        return [edge for edge in self.edges(idx) if self.is_post_action[self.edge_child[edge]]]
+
+    def children(self, idx):
+        return [self.edge_child[edge] for edge in self.edges(idx)]
+
+    def backpropagate(self, path, n, w, virtual_loss=0):
+        # n simulations passed through every node on the path, w of them (a float) won by self.player. No recursion, a few array operations.
+        # virtual_loss is taken off the path again, if add_virtual_loss was called for it
+        path = np.array(path)
+        with self.lock:
+            self.n[path] += n
+            self.w[path[self.is_post_action[path]]] += w
+            if virtual_loss:
+                self.virtual_loss[path] -= virtual_loss
+
+    def add_virtual_loss(self, path, virtual_loss=1):
+        with self.lock:
+            self.virtual_loss[np.array(path)] += virtual_loss
+
+    def evict(self, n_evict, protected=()):
+        # free the n_evict leaves with the fewest simulations. Only leaves are evicted, so every node that is left can still be reached from the root
+        top   = self.top
+        edges = np.flatnonzero(self.edge_in_use[:self.edge_top])
+        edges = edges[self.edge_generation[edges] == self.generation[self.edge_child[edges]]]
+        has_children = np.bincount(self.edge_parent[edges], minlength=top)[:top] > 0
+
+        candidates = self.in_use[:top] & ~has_children & (self.virtual_loss[:top] == 0)
+        candidates[[idx for idx in protected if idx >= 0]] = False
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) > n_evict:
+            candidates = candidates[np.argpartition(self.n[candidates], n_evict)[:n_evict]]
+
+        # the actions that led to the evicted nodes become untried again at their parents, otherwise they would never be expanded again
+        is_evicted = np.zeros(top, dtype=bool)
+        is_evicted[candidates] = True
+        for edge in edges[is_evicted[self.edge_child[edges]]]:
+            if self.is_post_action[self.edge_child[edge]]:
+                self.untried_actions.setdefault(int(self.edge_parent[edge]), []).append(int(self.edge_action[edge]))
+
+        for idx in candidates:
+            del self.child_index[self.keys[idx]]
+            self.keys[idx] = None
+            self.untried_actions.pop(idx, None)
+            self.chance_visits.pop(idx, None)
+            edge = self.first_edge[idx]
+            while edge >= 0: # the edges of a leaf only point to evicted nodes
+                self.free_edge(edge)
+                edge = self.edge_next[edge]
+            self.generation[idx] += 1
+            self.in_use[idx]      = False
+            self.free_nodes.append(idx)
+        self.n_nodes -= len(candidates)
+
+    def subtree(self, root):
+        # a new store with only what can be reached from root, which becomes node 0. The rest is dropped
+        old_idx    = [root]
+        new_idx    = {root : 0}
+        new_parent = {root : -1} # with transpositions, the parent a node was first reached from can be outside the subtree
+        for idx in old_idx: # breadth first, the list grows while we walk it
+            for child in self.children(idx):
+                if child not in new_idx:
+                    new_idx[child]    = len(old_idx)
+                    new_parent[child] = new_idx[idx]
+                    old_idx.append(child)
+
+        store = NodeStore(self.player, self.player_names, self.n_species, self.max_n_hand, c=self.c, transpositions=self.transpositions, max_nodes=self.max_nodes, capacity=max(1024, 2*len(old_idx)))
+        for old in old_idx:
+            idx = store.add(new_parent[old], self.is_post_action[old], self.observation(old), self.whose_turn_[old], self.action_id[old], link=False)
+            store.n[idx]      = self.n[old]
+            store.w[idx]      = self.w[old]
+            if old in self.untried_actions:
+                store.untried_actions[idx] = self.untried_actions[old]
+            if old in self.chance_visits:
+                store.chance_visits[idx] = self.chance_visits[old]
+        for old in old_idx:
+            for edge in self.edges(old):
+                store.add_edge(new_idx[old], new_idx[self.edge_child[edge]], self.edge_action[edge])
+        store.n_created = store.n_nodes
+        return store
 
 class Node():
-    def __init__(self, game, player, event=None, parent=None, c=np.sqrt(2)):
-        self.player   = player # an agent
-        self.parent   = parent # a node
-        self.children = []
+    '''
+    A handle to node idx of a NodeStore, it holds no data of its own.
+    Handles are cheap to create, the trees themselves work with the indices. Node.from_game(game, player) shows the information set of a player outside any tree.
+    Results are backpropagated by the trees along the path the simulation took (NodeStore.backpropagate), never from a handle.
 
-        self.whose_turn = game.whose_turn
-        self.hand       = game.hands[self.player]
-        self.field      = game.field
-        self.jungle     = game.jungle(self.player)
+    With transpositions=True a node can have several parents, and parent is only the one it was first reached from.
+    The ucb of such a node is then computed with the visits of that parent, not necessarily the parent it is being selected from.
+    '''
+    __slots__ = ("store", "idx")
 
-        self.n = 0 # number of simulations run from this node
+    def __init__(self, store, idx):
+        self.store = store
+        self.idx   = idx
 
-        # event is the event that transitioned the parent node to the current node
-        self.is_root_node        = parent is None
-        self.is_post_action_node = (event["kind"] == "action" and event["who"] == self.player) if event is not None else False
+    @classmethod
+    def from_game(cls, game, player):
+        # a standalone view of what player observes in game: the root of a store of its own, like the root of a new Tree
+        store = NodeStore(player, game.player_names, game.n_species, game.max_n_hand, capacity=1)
+        return cls(store, store.add(-1, False, observation_key(game, player), game.whose_turn_))
 
-        # initialise an empty variable
-        self.untried_actions = None
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.store is other.store and self.idx == other.idx
 
-        if self.is_post_action_node:
-            self.action = event
-            self.w = 0 # number of simulations won
-            self.c = c # hyperparameter that determines the tradeoff between exploration and exploitation
+    def __hash__(self):
+        return hash((id(self.store), self.idx))
 
     @property
-    def ucb(self):
-        if self.is_post_action_node:
-            return (self.w / self.n) + self.c * np.sqrt(2*np.log(self.parent.n)/self.n) # what if n==0?
+    def player(self):
+        return self.store.player
 
-    def backpropagate(self, winner):
-        self.n += 1
+    @property
+    def parent(self):
+        parent = self.store.parent[self.idx]
+        return Node(self.store, parent) if parent >= 0 else None
+
+    @property
+    def children(self):
+        return [Node(self.store, child) for child in self.store.children(self.idx)]
+
+    @property
+    def is_root_node(self):
+        return self.store.parent[self.idx] < 0
+
+    @property
+    def is_post_action_node(self):
+        return bool(self.store.is_post_action[self.idx])
+
+    @property
+    def key(self):
+        return (self.player, self.is_post_action_node, self.store.observation(self.idx))
+
+    def observed(self, i):
+        # 0: hand, 1: field, 2: jungle
+        n_species = self.store.n_species
+        return np.frombuffer(self.store.observation(self.idx), dtype=np.uint8)[i*n_species:(i+1)*n_species].astype(int)
+
+    @property
+    def hand(self):
+        return self.observed(0)
+
+    @property
+    def field(self):
+        return self.observed(1)
+
+    @property
+    def jungle(self):
+        return self.observed(2)
+
+    @property
+    def whose_turn(self):
+        return self.store.player_names[self.store.whose_turn_[self.idx]]
+
+    @property
+    def n(self):
+        return int(self.store.n[self.idx])
+
+    @property
+    def w(self):
+        return float(self.store.w[self.idx])
+
+    @property
+    def action(self):
         if self.is_post_action_node:
-            self.w += winner == self.player
+            return self.store.action(self.idx)
 
-        if self.parent is not None: # backpropagate all the way up to the root node. The root node doesn't have a parent
-            self.parent.backpropagate(winner)
+    @property
+    def untried_actions(self):
+        return self.store.untried_actions.get(self.idx)
+
+    @property
+    def ucb(self):
+        if self.is_post_action_node:
+            n        = self.n + int(self.store.virtual_loss[self.idx]) # a virtual loss is a visit without a win
+            parent_n = self.parent.n + int(self.store.virtual_loss[self.parent.idx])
+            return (self.w / n) + self.store.c * np.sqrt(2*np.log(parent_n)/n) # what if n==0?
 
     def __repr__(self):
         s = \
@@ -150,51 +647,162 @@ class Node():
         "self: " + self.player + "\n" + \
         "turn: " + self.whose_turn + "\n" + \
         "n: " + str(self.n) + "\n" + \
-        ("w: " + str(self.w) + "\n" if self.is_post_action_node else "") + \
+        ("w: " + "{:g}".format(self.w) + "\n" if self.is_post_action_node else "") + \
         "jungle:\n" + str(self.jungle) + "\n"+ \
         "field:\n" + str(self.field) + "\n" + \
         "hand:\n" + str(self.hand) + "\n"
         return s
 
 class Tree():
-    def __init__(self, game, player):
+    def __init__(self, game, player, c=np.sqrt(2), transpositions=False, max_nodes=None, rollout_policy=None):
         self.game   = game # assign by reference. If the game changes outside, it changes inside as well
         self.player = player
 
-        self.root_node    = Node(copy.deepcopy(game), player) # use deepcopy to ensure that if the game changes outside the node, the attributes of the node don't change
-        self.current_node = self.root_node
+        # how actions are selected once the simulation has left the tree, see rollout_policy
+        self.rollout_policy = rollout_policy_.UniformPolicy() if rollout_policy is None else rollout_policy
+
+        # see NodeStore for transpositions (merge information sets reached along different paths) and max_nodes (a memory cap)
+        self.store = NodeStore(player, game.player_names, game.n_species, game.max_n_hand, c=c, transpositions=transpositions, max_nodes=max_nodes)
+        self.root  = self.store.add(-1, False, self.observation(), game.whose_turn_)
+
+        # the nodes visited in the current simulation, starting at the root. self.current is the last one
+        self.path    = [self.root]
+        self.current = self.root
 
         # during selection (self.is_on_rollout_policy=False), we select actions based on UCB and keep track of new nodes.
-        # during rollout (self.is_on_rollout_policy=True), we select actions randomly and do NOT keep track of new nodes
+        # during rollout (self.is_on_rollout_policy=True), we select actions with the rollout policy and do NOT keep track of new nodes
         self.is_on_rollout_policy = False
 
+    @property
+    def root_node(self):
+        return Node(self.store, self.root)
+
+    @property
+    def current_node(self):
+        return Node(self.store, self.current)
+
+    @property
+    def n_nodes(self):
+        return self.store.n_nodes
+
+    @property
+    def n_created(self):
+        return self.store.n_created
+
+    def observation(self, observation=None):
+        # the observation_key of self.player (pass it if the caller has it already), followed by the scores with transpositions.
+        # The scores are public, the key of a transposition holds no parent that would tell positions with different scores apart
+        observation = observation_key(self.game, self.player) if observation is None else observation
+        if self.store.transpositions:
+            observation += self.game.scores_.astype(np.uint16).tobytes()
+        return observation
+
+    def reset(self):
+        self.path    = [self.root]
+        self.current = self.root
+        self.is_on_rollout_policy = False # switch to UCB-policy rather than rollout policy
+
     def select_action(self, return_best_action=False):
+        store = self.store
         if return_best_action: # the child with the highest number of visits
-            return self.current_node.children[np.argmax([child.n for child in self.current_node.children])].action
+            edges = store.action_edges(self.current)
+            edge  = edges[np.argmax(store.n[store.edge_child[edges]])]
+            return store.action(store.edge_child[edge], store.edge_action[edge])
         else:
-            if self.is_on_rollout_policy: # a random action
-                return np.random.choice(self.game.allowed_actions(self.player))
+            if self.is_on_rollout_policy:
+                return self.rollout_policy.select_action(self.game, self.player)
             else: # try each action at least once, then select action with highest UCB
-                if self.current_node.untried_actions is None and len(self.current_node.children) == 0:
-                    self.current_node.untried_actions = self.game.allowed_actions(self.player)
-                    random.shuffle(self.current_node.untried_actions)
-                if len(self.current_node.untried_actions) > 0:
-                    return self.current_node.untried_actions.pop()
-                return self.current_node.children[np.argmax([child.ucb for child in self.current_node.children])].action
+                edges = store.action_edges(self.current)
+                if self.current not in store.untried_actions and len(edges) == 0:
+                    store.untried_actions[self.current] = self.game.rng.permutation(self.game.legal_action_ids(self.player)).tolist() # action ids, see action_table
+                untried_actions = store.untried_actions.get(self.current)
+                if untried_actions is not None:
+                    action_id = untried_actions.pop()
+                    if len(untried_actions) == 0:
+                        del store.untried_actions[self.current]
+                    return self.game.action_event(self.player, action_id)
+                children = store.edge_child[edges]
+                n    = store.n[children] + store.virtual_loss[children] # a virtual loss is a visit without a win, see NodeStore
+                ucb  = store.w[children] / n + store.c * np.sqrt(2*np.log(store.n[self.current] + store.virtual_loss[self.current]) / n)
+                edge = edges[np.argmax(ucb)]
+                return store.action(store.edge_child[edge], store.edge_action[edge])
 
-    def apply_event(self, event):
+    def stratified_card_draw(self):
+        '''
+        The card draw of self.player at the current node by systematic sampling over all distinct draws (see draw_outcomes):
+        the i-th draw from a counter takes the outcome at position (offset + i*golden ratio) % 1 of the cumulative probabilities,
+        with a random offset per counter. Every draw, the first one included, has the probability of its outcome,
+        and over the simulations that pass through the node the draws come up in proportion to their probabilities with far less noise than sampling.
+        The counters are kept per deck, because the deck behind the same information set differs between simulations
+        '''
+        outcomes, probabilities = draw_outcomes(tuple(self.game.deck.tolist()), self.game.n_to_draw)
+        counters = self.store.chance_visits.setdefault(self.current, {})
+        counter  = counters.get(self.game.deck.tobytes())
+        if counter is None:
+            counter = counters[self.game.deck.tobytes()] = [self.game.rng.random(), 0] # offset, draws so far
+        position = (counter[0] + counter[1] * GOLDEN_RATIO) % 1.0
+        k = min(int(np.searchsorted(np.cumsum(probabilities), position, side="right")), len(outcomes) - 1)
+        counter[1] += 1
+        return self.game.card_draw_event(outcomes[k].copy())
+
+    def apply_event(self, event, observation=None):
+        # observation is the observation_key of self.player after the event, if the caller has it already
         if not self.is_on_rollout_policy:
-            new_node = Node(copy.deepcopy(self.game), event=event, player=self.player, parent=self.current_node)
-            for existing_node in [self.current_node, *self.current_node.children]:
-                if is_equivalent_node(existing_node, new_node):
-                    self.current_node = existing_node
-                    return
-            self.current_node.children.append(new_node)
-            self.current_node = new_node
-            self.is_on_rollout_policy = True
+            observation = self.observation(observation)
+            if observation == self.store.observation(self.current): # the event changed nothing the player can observe (like the opponent drawing cards), so the information set stays the same
+                return
+            is_post_action = is_post_action_event(event, self.player)
+            action_id = (event["action_id"] if "action_id" in event else self.game.action_id(event["cards"])) if is_post_action else -1
+            child = self.store.child(self.current, is_post_action, observation, self.game.whose_turn_)
+            if child < 0:
+                child = self.store.add(self.current, is_post_action, observation, self.game.whose_turn_, action_id, protected=self.path)
+                self.is_on_rollout_policy = True
+            elif self.store.transpositions:
+                self.store.link(self.current, child, action_id)
+            self.path.append(child)
+            self.current = child
 
     def backpropagate(self, winner):
-        self.current_node.backpropagate(winner)
+        self.store.backpropagate(self.path, 1, winner == self.player)
+
+    def backpropagate_rewards(self, rewards, n=1):
+        # rewards holds the (fractional) wins of each player over n simulations, in the order of game.player_names
+        self.store.backpropagate(self.path, n, float(rewards[self.game.player_idx[self.player]]))
+
+    def backpropagate_batch(self, wins):
+        # wins holds the number of simulations won by each player, fractional if the rollouts were cut off
+        self.backpropagate_rewards(wins, n=int(round(np.sum(wins))))
+
+    def promote_current_node(self):
+        # make the current node the new root, the statistics in its subtree are kept and the rest of the tree is dropped
+        if self.current != self.root: # an event the player can't observe (like another player's card draw) leaves the root where it is, nothing to drop
+            self.store = self.store.subtree(self.current)
+            self.root  = 0
+        self.reset()
+
+    def root_statistics(self):
+        # the number of simulations and wins per action from the root node, in a form that can be sent between processes
+        store = self.store
+        statistics = []
+        for edge in store.edges(self.root):
+            child = store.edge_child[edge]
+            if store.is_post_action[child]:
+                statistics.append((store.action(child, store.edge_action[edge]), int(store.n[child]), float(store.w[child])))
+        return statistics
+
+    def merge_root_statistics(self, statistics):
+        # add the root statistics of an independent search of the same root state to this tree
+        for action, n, w in statistics:
+            self.game.apply_event(action)
+            child = self.store.child(self.root, True, self.observation(), self.game.whose_turn_)
+            if child < 0:
+                child = self.store.add(self.root, True, self.observation(), self.game.whose_turn_, action["action_id"])
+            elif self.store.transpositions:
+                self.store.link(self.root, child, action["action_id"])
+            self.game.undo_event()
+            self.store.n[child]     += n
+            self.store.w[child]     += w
+            self.store.n[self.root] += n
 
     def __repr__(self):
         def print_children(node): # recursion!
@@ -204,44 +812,80 @@ class Tree():
 class Simulators():
     '''
     A class that keeps track of how the game proceeds as viewed by all
-    entities that can have an influence on the game. These entities are player0, player1 and the game itself.
+    entities that can have an influence on the game. These entities are the players (player0, player1, ...) and the game itself.
 
-    Player0 can view the cards in its own hand, but not the hand of the opponent
+    Player0 can view the cards in its own hand, but not the hands of its opponents
     Player0 can perform an action and put cards from its hand to the field
-    Player0 decides what actions to play based on UCB (random for rollout policy)
+    Player0 decides what actions to play based on UCB (or the rollout policy once it has left its tree)
     Player0 can't control what cards to draw from the deck
 
-    Player1 likewise
+    The other players likewise, every player has a tree of its own
 
     The last entity is 'the game itself', it decides what cards to deal to the players
+
+    Once every tree has switched to the rollout policy, nothing is added to the trees anymore.
+    With rollout_batch_size > 1 the rest of the game is then played out rollout_batch_size times, and all the results are backpropagated together.
+    From batch_rollout.MIN_BATCH_SIZE on the games are played at once by batch_rollout, smaller batches are faster as single games one after the other.
+
+    Pass an instrumentation.Instrumentation to time the phases of each simulation and count what happens in the trees.
+
+    transpositions and max_nodes are passed on to the trees, see NodeStore.
+    rollout_policy (a rollout_policy.RolloutPolicy, uniform by default) is used by the trees and the batch rollouts.
+
+    With rollout_depth, a rollout is cut off after rollout_depth turns and the evaluator (evaluation.StaticEvaluator by default)
+    estimates the win probability of every player, which is backpropagated as a fractional win.
+
+    With stratified_draws=True, a card draw that can have at most max_draw_outcomes distinct results is a chance node in the tree of the player who draws:
+    the draws are spread over the distinct results in proportion to their probabilities (see Tree.stratified_card_draw) rather than sampled.
+    That only happens near the end of the game, when few cards are left in the deck. benchmark.benchmark_stratified_draws measures whether it improves the decisions.
+
+    simulate_parallel is the tree-parallel alternative to simulate: the descent is made here, the rollout of its leaf runs in an executor
+    and its result is backpropagated by the executor when it is done, while the next descents go on (see Searcher.run_parallel).
     '''
-    def __init__(self, game):
-        self.reset_state = copy.deepcopy(game)
+    def __init__(self, game, rollout_batch_size=1, instrumentation=None, transpositions=False, max_nodes=None, rollout_policy=None, rollout_depth=None, evaluator=None, stratified_draws=False, max_draw_outcomes=64):
         self.game      = game
-        self.tree_dict = {player : Tree(self.game, player) for player in self.game.player_names}
+        self.reset_history_length = len(game.history) # every simulation is rewound to this point in the history of the game
+        self.rollout_batch_size   = rollout_batch_size
+        self.rollout_policy       = rollout_policy_.UniformPolicy() if rollout_policy is None else rollout_policy
+        self.rollout_depth        = rollout_depth
+        self.evaluator            = evaluation.StaticEvaluator() if evaluator is None else evaluator
+        self.stratified_draws     = stratified_draws
+        self.max_draw_outcomes    = max_draw_outcomes
+        self.instrumentation      = instrumentation
+        self.tree_dict = {player : Tree(self.game, player, transpositions=transpositions, max_nodes=max_nodes, rollout_policy=self.rollout_policy) for player in self.game.player_names}
         self.trees     = self.tree_dict.values()
 
+        # the rollouts of simulate_parallel that are still running, and the errors of the ones that failed
+        self.in_flight         = 0
+        self.in_flight_changed = threading.Condition()
+        self.errors            = []
+
     @property
     def whose_turn(self):
         return self.game.whose_turn
 
     def random_card_draw(self):
+        if self.stratified_draws:
+            tree = self.tree_dict[self.whose_turn]
+            if not tree.is_on_rollout_policy and n_draw_outcomes(self.game.deck, self.game.n_to_draw) <= self.max_draw_outcomes:
+                return tree.stratified_card_draw()
         return self.game.random_card_draw()
 
     def select_action(self, return_best_action=False):
         return self.tree_dict[self.whose_turn].select_action(return_best_action=return_best_action)
 
     def reset_game(self):
-        self.game = copy.deepcopy(self.reset_state)
+        self.game.rewind(self.reset_history_length)
         for tree in self.trees:
-            tree.game = self.game
-            tree.current_node = tree.root_node
-            tree.is_on_rollout_policy = False # switch to UCB-policy rather than rollout policy
+            tree.reset()
 
     def apply_event(self, event):
-        # for simulator in [self.game, *self.trees]:
-        for simulator in [self.game, *self.tree_dict.values()]:
-            simulator.apply_event(event)
+        self.game.apply_event(event)
+        if all(tree.is_on_rollout_policy for tree in self.trees): # the trees don't follow the game anymore
+            return
+        observations = observation_keys(self.game)
+        for player, tree in self.tree_dict.items():
+            tree.apply_event(event, observations[self.game.player_idx[player]])
 
     def next_turn(self):
         self.game.next_turn()
@@ -250,23 +894,379 @@ class Simulators():
         for tree in self.trees:
             tree.backpropagate(winner)
 
-def moismcts(root_state, n=500):
+    def backpropagate_rewards(self, rewards):
+        for tree in self.trees:
+            tree.backpropagate_rewards(rewards)
+
+    def backpropagate_batch(self, wins):
+        for tree in self.trees:
+            tree.backpropagate_batch(wins)
+
+    def batch_rollout_wins(self):
+        if self.rollout_batch_size < batch_rollout.MIN_BATCH_SIZE:
+            return rollout_games(self.game, self.rollout_batch_size, self.rollout_policy, self.rollout_depth, self.evaluator)
+        return batch_rollout.rollout_wins(self.game, self.rollout_batch_size, rng=self.game.rng, policy=self.rollout_policy, max_depth=self.rollout_depth, evaluator=self.evaluator)
+
+    def simulate(self):
+        # play a single game from the root state to the end, update the trees and rewind the game
+        # returns the number of game results that were backpropagated
+        if self.instrumentation is not None:
+            return self.simulate_instrumented()
+
+        while not self.game.is_final:
+            if all(tree.is_on_rollout_policy for tree in self.trees): # the rest is played on the game alone, the trees have nothing to follow
+                if self.rollout_batch_size > 1:
+                    self.backpropagate_batch(self.batch_rollout_wins())
+                    self.reset_game()
+                    return self.rollout_batch_size
+                self.backpropagate_rewards(rollout_game(self.game, self.rollout_policy, self.rollout_depth, self.evaluator))
+                self.reset_game()
+                return 1
+            self.apply_event(self.random_card_draw()) # give cards to the player whose turn it is, at the very first turn, this should not do anything
+            self.apply_event(self.select_action()) # the player whose turn it is may select the action, apply the action to the game and update both the players' trees
+            self.next_turn()
+
+        winner = self.game.leading_player
+        self.backpropagate(winner)
+        self.reset_game()
+        return 1
+
+    def select_leaf(self):
+        # the selection part of simulate: play on until every tree has switched to the rollout policy, at the start of a turn.
+        # returns True if the game ended before that
+        while not self.game.is_final:
+            if all(tree.is_on_rollout_policy for tree in self.trees):
+                return False
+            self.apply_event(self.random_card_draw())
+            self.apply_event(self.select_action())
+            self.next_turn()
+        return True
+
+    def simulate_parallel(self, executor, virtual_loss=1):
+        '''
+        One descent of a tree-parallel search. The rollout_batch_size games from the leaf are handed to executor (threads or processes)
+        with a random stream of their own, and the game is rewound right away: fewer than batch_rollout.MIN_BATCH_SIZE games
+        as a snapshot of the game (see rollout_games), more as a batch_rollout.BatchKariba.
+        Until the result is backpropagated by leaf_done, every node on the path carries virtual_loss (see NodeStore).
+        Returns the number of game results the descent will backpropagate
+        '''
+        if self.select_leaf(): # the game ended inside the trees, nothing to hand off
+            self.backpropagate(self.game.leading_player)
+            self.reset_game()
+            return 1
+
+        paths = [(tree.store, tree.path) for tree in self.trees] # reset_game gives the trees new paths, these stay as they are
+        for store, path in paths:
+            store.add_virtual_loss(path, virtual_loss)
+        rng = util.make_rng(int(self.game.rng.integers(2**63)))
+
+        with self.in_flight_changed:
+            self.in_flight += 1
+        if self.rollout_batch_size < batch_rollout.MIN_BATCH_SIZE: # a small batch is slower than single games
+            future = executor.submit(rollout_games, self.game.snapshot(rng), self.rollout_batch_size, self.rollout_policy, self.rollout_depth, self.evaluator)
+        else:
+            batch  = batch_rollout.BatchKariba.from_game(self.game, self.rollout_batch_size, rng=rng, policy=self.rollout_policy)
+            future = executor.submit(batch_rollout.batch_wins, batch, self.rollout_depth, self.evaluator)
+        future.add_done_callback(functools.partial(self.leaf_done, paths, virtual_loss))
+        self.reset_game()
+        return self.rollout_batch_size
+
+    def leaf_done(self, paths, virtual_loss, future):
+        # called in a thread of the executor when the rollouts of simulate_parallel are done
+        try:
+            wins = future.result()
+            for store, path in paths:
+                store.backpropagate(path, int(round(np.sum(wins))), float(wins[self.game.player_idx[store.player]]), virtual_loss=virtual_loss)
+        except BaseException as error: # raised again by wait_in_flight, in the thread of the search
+            self.errors.append(error)
+        finally:
+            with self.in_flight_changed:
+                self.in_flight -= 1
+                self.in_flight_changed.notify_all()
+
+    def wait_in_flight(self, max_in_flight=0):
+        # block until at most max_in_flight rollouts of simulate_parallel are running, their results have been backpropagated then
+        with self.in_flight_changed:
+            self.in_flight_changed.wait_for(lambda: self.in_flight <= max_in_flight or len(self.errors) > 0)
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+
+    def apply_event_instrumented(self, event):
+        n_searching = sum(not tree.is_on_rollout_policy for tree in self.trees)
+        n_created   = sum(tree.n_created for tree in self.trees)
+        self.apply_event(event)
+        self.instrumentation.count("node_lookups", n_searching)
+        self.instrumentation.count("nodes_created", sum(tree.n_created for tree in self.trees) - n_created)
+
+    def simulate_instrumented(self):
+        # the same as simulate, with every phase timed and counted
+        instrumentation = self.instrumentation
+        clock = time.perf_counter
+
+        n_results = 1
+        depth     = 0
+        while not self.game.is_final:
+            is_rollout = all(tree.is_on_rollout_policy for tree in self.trees)
+            if self.rollout_batch_size > 1 and is_rollout:
+                t0 = clock()
+                wins = self.batch_rollout_wins()
+                t1 = clock()
+                self.backpropagate_batch(wins)
+                t2 = clock()
+                instrumentation.add_time("rollout", t1 - t0)
+                instrumentation.add_time("backpropagation", t2 - t1)
+                instrumentation.count("batch_rollouts")
+                n_results = self.rollout_batch_size
+                break
+            if is_rollout and self.rollout_depth is not None:
+                if depth >= self.rollout_depth:
+                    t0 = clock()
+                    rewards = self.evaluator.win_probabilities(self.game)
+                    t1 = clock()
+                    self.backpropagate_rewards(rewards)
+                    t2 = clock()
+                    instrumentation.add_time("evaluation", t1 - t0)
+                    instrumentation.add_time("backpropagation", t2 - t1)
+                    instrumentation.count("cutoffs")
+                    break
+                depth += 1
+
+            t0 = clock()
+            draw = self.random_card_draw()
+            t1 = clock()
+            self.apply_event_instrumented(draw)
+            t2 = clock()
+            action = self.select_action()
+            t3 = clock()
+            self.apply_event_instrumented(action)
+            t4 = clock()
+            self.next_turn()
+
+            instrumentation.add_time("card_draw", t1 - t0)
+            instrumentation.add_time("rollout" if is_rollout else "selection", t3 - t2)
+            instrumentation.add_time("tree_update", (t2 - t1) + (t4 - t3))
+            instrumentation.count("rollout_depth" if is_rollout else "selection_depth")
+        else: # the game was played to the end without a batch rollout or a cutoff
+            t0 = clock()
+            self.backpropagate(self.game.leading_player)
+            instrumentation.add_time("backpropagation", clock() - t0)
+
+        t0 = clock()
+        self.reset_game()
+        instrumentation.add_time("reset", clock() - t0)
+        instrumentation.end_simulation(self)
+        return n_results
+
+    def advance(self, event):
+        # apply an event that happened in the real game to the root state and move the root of every tree along with it
+        self.wait_in_flight() # a rollout that is still running would backpropagate into the old trees
+        self.reset_game()
+        self.apply_event(event) # like in a simulation, each tree moves to the equivalent child node or creates it
+        for tree in self.trees:
+            tree.promote_current_node()
+        self.reset_history_length = len(self.game.history)
+
+    def advance_turn(self):
+        self.wait_in_flight()
+        self.reset_game()
+        self.next_turn()
+
+class Searcher():
+    '''
+    An anytime interface to MOISMCTS. The trees are kept alive between calls,
+    so the search can be continued in small steps and stopped at any moment with the best action found so far.
+
+    step, run and moismcts count simulations as descents through the trees,
+    n_simulations counts game results (with a rollout_batch_size > 1 a descent can end in many results).
+
+    The search has its own random number generator, created from seed, so it can be replayed exactly
+    and doesn't share a random stream with the game it is searching (which would let it foresee the real card draws).
+
+    With an opening_book.OpeningBook, the search starts from the statistics the book holds for the root state, if any.
+    n_book counts the simulations that came from the book, they are included in n_simulations.
+    '''
+    def __init__(self, root_state, rollout_batch_size=1, seed=None, instrumentation=None, transpositions=False, max_nodes=None, rollout_policy=None, rollout_depth=None, evaluator=None, stratified_draws=False, max_draw_outcomes=64, opening_book=None):
+        self.simulators    = Simulators(
+            copy.deepcopy(root_state),
+            rollout_batch_size = rollout_batch_size,
+            instrumentation    = instrumentation,
+            transpositions     = transpositions,
+            max_nodes          = max_nodes,
+            rollout_policy     = rollout_policy,
+            rollout_depth      = rollout_depth,
+            evaluator          = evaluator,
+            stratified_draws   = stratified_draws,
+            max_draw_outcomes  = max_draw_outcomes
+        )
+        self.simulators.game.rng = util.make_rng(seed)
+        self.n_simulations = 0
+        self.n_book        = 0
+        self.elapsed       = 0.0 # seconds spent simulating
+
+        statistics = None if opening_book is None else opening_book.lookup(self.simulators.game)
+        if statistics is not None:
+            self.warm_start(statistics)
+            self.n_book = self.n_simulations
+
+    def warm_start(self, statistics):
+        # add root statistics [(action, n, w), ...] from elsewhere, like an opening book or another search, to the root of the player whose turn it is
+        self.simulators.tree_dict[self.simulators.whose_turn].merge_root_statistics(statistics)
+        self.n_simulations += sum(n for action, n, w in statistics)
+
+    def step(self, k=1):
+        start = time.perf_counter()
+        for _ in range(k):
+            self.n_simulations += self.simulators.simulate()
+        self.elapsed       += time.perf_counter() - start
+
+    def run(self, n=None, time_budget_ms=None, progress_bar=False):
+        # simulate until n simulations have been run in this call or the time budget is spent, whichever comes first
+        if n is None and time_budget_ms is None:
+            raise ValueError("either n or time_budget_ms must be given")
+        deadline = None if time_budget_ms is None else time.perf_counter() + time_budget_ms / 1000
+        with tqdm.tqdm(total=n, disable=not progress_bar) as pbar:
+            i = 0
+            while (n is None or i < n) and (deadline is None or time.perf_counter() < deadline):
+                self.step()
+                pbar.update()
+                i += 1
+
+    def run_parallel(self, executor, n=None, time_budget_ms=None, max_in_flight=4, virtual_loss=1):
+        '''
+        Tree-parallel search on the trees of this searcher: the descents are made in this thread and the rollouts of their leaves run in executor,
+        a thread or process pool, with up to max_in_flight of them at once. Their results are backpropagated as they come in,
+        the virtual loss on the paths that are still out keeps the descents in the meantime from all following the same path.
+        Returns once all results are in. n counts descents, like run.
+
+        The order in which the results come in depends on the timing of the workers, so unlike run, the same seed doesn't give the same search.
+        '''
+        if n is None and time_budget_ms is None:
+            raise ValueError("either n or time_budget_ms must be given")
+        if self.simulators.instrumentation is not None:
+            raise ValueError("run_parallel is not instrumented, use run")
+        start    = time.perf_counter()
+        deadline = None if time_budget_ms is None else start + time_budget_ms / 1000
+        try:
+            i = 0
+            while (n is None or i < n) and (deadline is None or time.perf_counter() < deadline):
+                self.simulators.wait_in_flight(max_in_flight - 1)
+                self.n_simulations += self.simulators.simulate_parallel(executor, virtual_loss)
+                i += 1
+        finally:
+            self.simulators.wait_in_flight()
+        self.elapsed += time.perf_counter() - start
+
+    def advance(self, event):
+        '''
+        Apply an event of the real game (a card draw or an action) to the root state of the search.
+        The trees keep the statistics of the subtree that corresponds to what happened, so the next search doesn't start from scratch
+        '''
+        self.simulators.advance(event)
+
+    def next_turn(self):
+        self.simulators.advance_turn()
+
+    def best_action(self):
+        if len(self.simulators.tree_dict[self.simulators.whose_turn].root_statistics()) == 0: # nothing is known yet, any allowed action is as good as another
+            game = self.simulators.game
+            return game.action_event(game.whose_turn, game.rng.choice(game.legal_action_ids(game.whose_turn)))
+        return self.simulators.select_action(return_best_action=True)
+
+    def stats(self):
+        return {
+            "n_simulations"          : self.n_simulations,
+            "elapsed"                : self.elapsed,
+            "simulations_per_second" : self.n_simulations / self.elapsed if self.elapsed > 0 else 0.0,
+            "actions"                : [{"cards" : action["cards"], "n" : n, "w" : w} for action, n, w in self.simulators.tree_dict[self.simulators.whose_turn].root_statistics()]
+        }
+
+def root_parallel_worker(root_state, n, seed, time_budget_ms=None, searcher_options={}, instrumented=False):
+    '''
+    Runs an independent search in a worker process and returns the root statistics of the player whose turn it is,
+    and the metrics of the search if it is instrumented (None otherwise). searcher_options are passed on to Searcher
+    '''
+    instrumentation = instrumentation_.Instrumentation() if instrumented else None
+
+    searcher = Searcher(root_state, seed=seed, instrumentation=instrumentation, **searcher_options)
+    searcher.run(n=n, time_budget_ms=time_budget_ms)
+
+    return searcher.simulators.tree_dict[searcher.simulators.whose_turn].root_statistics(), None if instrumentation is None else instrumentation.metrics()
+
+def moismcts(root_state, n=500, time_budget_ms=None, workers=1, executor=None, rollout_batch_size=1, seed=None, instrumentation=None, transpositions=False, max_nodes=None, rollout_policy=None, rollout_depth=None, evaluator=None, stratified_draws=False, max_draw_outcomes=64, opening_book=None, tree_parallel=False, virtual_loss=1):
     '''
     Multiple Observer Information Set Monte Carlo Tree Search (MOISMCTS)
     keeps a separate tree for each player in which the state is encoded according to what the player can observe
-    '''
 
-    simulators = Simulators(copy.deepcopy(root_state))
+    The search stops after n simulations or after time_budget_ms milliseconds, whichever comes first. Pass n=None to only search against the clock.
+
+    With workers > 1 the n simulations are divided over independent searches in a process pool (root parallelisation),
+    the visit and win counts of the actions from the root are summed before the best action is selected.
+    Every worker gets the full time budget, the start-up of the processes is not included in it.
+    Pass an existing executor to avoid starting a new process pool for every move.
+
+    With tree_parallel=True there is a single search instead, whose leaves are evaluated by the workers (see Searcher.run_parallel):
+    up to 2*workers rollouts run at once and every path that is out carries virtual_loss. The executor can then be a thread pool as well.
+
+    With rollout_batch_size > 1 every leaf is evaluated with that many games, from batch_rollout.MIN_BATCH_SIZE on all at once, see batch_rollout.
+    The rollouts choose their actions with rollout_policy, a rollout_policy.RolloutPolicy (uniformly random by default).
+    With rollout_depth, they are cut off after that many turns and the evaluator (evaluation.StaticEvaluator by default) estimates who wins.
+    With stratified_draws=True, card draws with at most max_draw_outcomes distinct results are spread over those results instead of sampled, see Simulators.
+
+    A search with the same seed and the same n gives the same result (a time budget makes the amount of simulations vary).
+    Every worker gets its own child stream of the seed.
+
+    Pass an instrumentation.Instrumentation to collect timers and counters of the search. The metrics of
+    root-parallel workers are merged into it after the search, its hooks are only called for simulations in this process.
+
+    With transpositions=True an information set that is reached along different paths is a single node (see NodeStore).
+    max_nodes caps the number of nodes in each tree, the least visited leaves are evicted when it is reached.
+
+    With an opening_book.OpeningBook that holds the root state, the simulations in the book count towards n:
+    only the rest is searched, and nothing at all if the book has n or more (or if there is only a time budget).
+    '''
+    searcher_options = {
+        "rollout_batch_size" : rollout_batch_size,
+        "transpositions"     : transpositions,
+        "max_nodes"          : max_nodes,
+        "rollout_policy"     : rollout_policy,
+        "rollout_depth"      : rollout_depth,
+        "evaluator"          : evaluator,
+        "stratified_draws"   : stratified_draws,
+        "max_draw_outcomes"  : max_draw_outcomes
+    }
+    searcher = Searcher(root_state, seed=seed, instrumentation=instrumentation, opening_book=opening_book, **searcher_options)
+    if searcher.n_book > 0:
+        if n is None or searcher.n_book >= n:
+            return searcher.best_action()
+        n -= searcher.n_book
 
-    for i in tqdm.tqdm(range(n)):
+    if tree_parallel:
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        try:
+            searcher.run_parallel(executor, n=n, time_budget_ms=time_budget_ms, max_in_flight=2*workers, virtual_loss=virtual_loss)
+        finally:
+            if own_executor:
+                executor.shutdown()
+    elif workers == 1 and executor is None:
+        searcher.run(n=n, time_budget_ms=time_budget_ms, progress_bar=True)
+    else:
+        n_per_worker = [None if n is None else n // workers + (i < n % workers) for i in range(workers)]
+        seeds        = util.spawn_seeds(seed, workers)
 
-        while not simulators.game.is_final:
-            simulators.apply_event(simulators.random_card_draw()) # give cards to the player whose turn it is, at the very first turn, this should not do anything
-            simulators.apply_event(simulators.select_action()) # the player whose turn it is may select the action, apply the action to the game and update both the players' trees
-            simulators.next_turn()
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        try:
+            worker_statistics = list(executor.map(root_parallel_worker, [searcher.simulators.game]*workers, n_per_worker, seeds, [time_budget_ms]*workers, [searcher_options]*workers, [instrumentation is not None]*workers))
+        finally:
+            if own_executor:
+                executor.shutdown()
 
-        winner = simulators.game.leading_player
-        simulators.backpropagate(winner)
-        simulators.reset_game()
+        for statistics, metrics in worker_statistics:
+            searcher.warm_start(statistics)
+            if metrics is not None:
+                instrumentation.merge(metrics)
 
-    return simulators.select_action(return_best_action=True)
+    return searcher.best_action()
@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import argparse
+import concurrent.futures
+import numpy as np
+
+import kariba_moismcts
+import util
+
+MAGIC = b"KARIBOOK"
+
+def book_key(game):
+    '''
+    The information set of the player whose turn it is: the scores, starting with that player, and what that player observes (see observation_key).
+    The scores are rotated so the same situation gets the same key whichever seat the player is in
+    '''
+    scores = np.roll(game.scores_, -game.whose_turn_).astype(np.uint8).tobytes()
+    return scores + kariba_moismcts.observation_key(game, game.whose_turn)
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+class OpeningBook():
+    '''
+    Action statistics of deep searches from early information sets, read from a file made by write_book.
+
+    The file is memory-mapped the first time it is looked up in, so creating an OpeningBook costs nothing
+    and only the pages that are used are read from disk. A pickled OpeningBook only holds its path, so it can be sent to worker processes.
+
+    Layout of the file (little endian): MAGIC, the length of a json header and the header (padded to a multiple of 8 bytes), then the arrays
+        hashes      uint64  (n_entries,)          key_hash of every key, sorted
+        keys        uint8   (n_entries, key_size) the keys in the same order, to tell hash collisions apart
+        offsets     uint32  (n_entries+1,)        the statistics of entry i are in rows offsets[i]:offsets[i+1] of the arrays below
+        action_ids  uint16  (n_stats,)
+        n           uint32  (n_stats,)
+        w           float32 (n_stats,)            wins, fractional if the searches cut their rollouts off
+    '''
+    version = 2
+    arrays  = [("hashes", np.uint64), ("keys", np.uint8), ("offsets", np.uint32), ("action_ids", np.uint16), ("n", np.uint32), ("w", np.float32)]
+
+    def __init__(self, path):
+        self.path   = path
+        self.header = None
+
+    def __getstate__(self):
+        return {"path" : self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(self.path + " is not an opening book")
+            header_size = int.from_bytes(f.read(4), "little")
+            self.header = json.loads(f.read(header_size))
+        if self.header["version"] != self.version:
+            raise ValueError("{} is an opening book of version {}, this is version {}. Run opening_book.py again".format(self.path, self.header["version"], self.version))
+
+        n_entries, n_stats, key_size = self.header["n_entries"], self.header["n_stats"], self.header["key_size"]
+        shapes = {"hashes" : (n_entries,), "keys" : (n_entries, key_size), "offsets" : (n_entries+1,), "action_ids" : (n_stats,), "n" : (n_stats,), "w" : (n_stats,)}
+        offset = len(MAGIC) + 4 + header_size
+        for name, dtype in self.arrays:
+            if np.prod(shapes[name]) == 0: # np.memmap can't map an empty array
+                setattr(self, name, np.zeros(shapes[name], dtype=dtype))
+            else:
+                setattr(self, name, np.memmap(self.path, dtype=np.dtype(dtype).newbyteorder("<"), mode="r", offset=offset, shape=shapes[name]))
+            offset += int(np.prod(shapes[name])) * np.dtype(dtype).itemsize
+
+    def __len__(self):
+        if self.header is None:
+            self.load()
+        return self.header["n_entries"]
+
+    def matches(self, game):
+        # the book only holds information sets of games with the same number of players, species and cards in a hand
+        return (game.n_players, game.n_species, game.max_n_hand) == (self.header["n_players"], self.header["n_species"], self.header["max_n_hand"])
+
+    def lookup(self, game):
+        '''
+        The root statistics [(action, n, w), ...] that the book holds for the player whose turn it is, in the format of Tree.root_statistics.
+        None if the information set is not in the book
+        '''
+        if self.header is None:
+            self.load()
+        if not self.matches(game):
+            return None
+
+        key = book_key(game)
+        i   = np.searchsorted(self.hashes, np.uint64(key_hash(key)))
+        while i < len(self.hashes) and self.hashes[i] == key_hash(key):
+            if self.keys[i].tobytes() == key:
+                rows = slice(int(self.offsets[i]), int(self.offsets[i+1]))
+                return [(game.action_event(game.whose_turn, int(action_id)), int(n), float(w)) for action_id, n, w in zip(self.action_ids[rows], self.n[rows], self.w[rows])]
+            i += 1
+        return None
+
+def write_book(path, entries, n_players, n_species, max_n_hand, **info):
+    '''
+    Write entries {key : {action_id : [n, w]}} to path in the format of OpeningBook.
+    info is kept in the header, e.g. how the book was computed
+    '''
+    keys     = sorted(entries, key=key_hash)
+    key_size = len(keys[0]) if len(keys) > 0 else 0
+    stats    = [sorted(entries[key].items()) for key in keys]
+
+    data = {
+        "hashes"     : np.array([key_hash(key) for key in keys], dtype=np.uint64),
+        "keys"       : np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), key_size),
+        "offsets"    : np.concatenate(([0], np.cumsum([len(s) for s in stats]))).astype(np.uint32),
+        "action_ids" : np.array([action_id for s in stats for action_id, (n, w) in s], dtype=np.uint16),
+        "n"          : np.array([n for s in stats for action_id, (n, w) in s], dtype=np.uint32),
+        "w"          : np.array([w for s in stats for action_id, (n, w) in s], dtype=np.float32)
+    }
+
+    header = {
+        "version"    : OpeningBook.version,
+        "n_players"  : n_players,
+        "n_species"  : n_species,
+        "max_n_hand" : max_n_hand,
+        "key_size"   : key_size,
+        "n_entries"  : len(keys),
+        "n_stats"    : len(data["n"]),
+        **info
+    }
+    header_bytes = json.dumps(header).encode()
+    header_bytes = header_bytes.ljust(len(header_bytes) + (-len(header_bytes) % 8)) # MAGIC and the length take 12 bytes, so the arrays start at a multiple of 8 bytes
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        for name, dtype in OpeningBook.arrays:
+            f.write(data[name].astype(np.dtype(dtype).newbyteorder("<")).tobytes())
+
+def search_opening(seed, n_turns=2, n=5000, n_players=2, searcher_options={}):
+    '''
+    Plays the first n_turns turns of a game with a random deal, searching n simulations at every turn.
+    Returns the root statistics of every search as {key : {action_id : [n, w]}}
+    '''
+    game_seed, search_seed = util.spawn_seeds(seed, 2)
+    game = kariba_moismcts.Kariba(player_names=["player{}".format(i) for i in range(n_players)], rng=util.make_rng(game_seed))
+
+    entries = {}
+    for search_seed in util.spawn_seeds(search_seed, n_turns):
+        if game.is_final:
+            break
+        game.apply_event(game.random_card_draw())
+
+        searcher = kariba_moismcts.Searcher(game, seed=search_seed, **searcher_options)
+        searcher.run(n=n)
+        entry = entries.setdefault(book_key(game), {})
+        for action, n_action, w_action in searcher.simulators.tree_dict[game.whose_turn].root_statistics():
+            n_w = entry.setdefault(action["action_id"], [0, 0])
+            n_w[0] += n_action
+            n_w[1] += w_action
+
+        game.apply_event(searcher.best_action()) # the opening goes on the way the search would play it
+        game.next_turn()
+    return entries
+
+def build_book(path, n_games=500, n_turns=2, n=5000, n_players=2, workers=1, seed=0, searcher_options={}):
+    '''
+    The offline precomputation of an opening book: searches the first n_turns turns of n_games games with random deals.
+    The information sets that come up more than once get the statistics of all their searches summed, so the common ones are searched the deepest
+    '''
+    seeds = util.spawn_seeds(seed, n_games)
+    if workers == 1:
+        results = list(map(search_opening, seeds, [n_turns]*n_games, [n]*n_games, [n_players]*n_games, [searcher_options]*n_games))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(search_opening, seeds, [n_turns]*n_games, [n]*n_games, [n_players]*n_games, [searcher_options]*n_games))
+
+    entries = {}
+    for game_entries in results:
+        for key, game_entry in game_entries.items():
+            entry = entries.setdefault(key, {})
+            for action_id, (n_action, w_action) in game_entry.items():
+                n_w = entry.setdefault(action_id, [0, 0])
+                n_w[0] += n_action
+                n_w[1] += w_action
+
+    game = kariba_moismcts.Kariba(player_names=["player{}".format(i) for i in range(n_players)])
+    write_book(path, entries, game.n_players, game.n_species, game.max_n_hand, n_games=n_games, n_turns=n_turns, n=n, seed=seed)
+    return entries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute an opening book for MOISMCTS")
+    parser.add_argument("--out", default="opening_book.bin")
+    parser.add_argument("--games", type=int, default=500, help="games with a random deal whose openings are searched")
+    parser.add_argument("--turns", type=int, default=2, help="turns searched per game")
+    parser.add_argument("--n", type=int, default=5000, help="simulations per search")
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--rollout-batch-size", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    entries = build_book(args.out, n_games=args.games, n_turns=args.turns, n=args.n, n_players=args.players, workers=args.workers, seed=args.seed, searcher_options={"rollout_batch_size" : args.rollout_batch_size})
+    print("{} information sets written to {} ({} bytes)".format(len(entries), args.out, os.path.getsize(args.out)))
@@ -0,0 +1,92 @@
+import numpy as np
+
+def capture_points(hands, field, max_n_hand):
+    '''
+    The points every action would score right now, for hands and field of shape (B, n_species).
+    Returns shape (B, n_species*max_n_hand) in the order of action_table, with -1 for the actions that are not allowed.
+
+    This is the chase rule of Kariba.apply_event for all actions at once: 3 or more animals of a species
+    chase away the closest weaker species on the field, mice chase away elephants.
+    '''
+    batch_size, n_species = field.shape
+    species = np.arange(n_species)
+
+    on_field    = np.where(field > 0, species, -1)
+    closest     = np.maximum.accumulate(on_field, axis=1) # the strongest species on the field up to and including each species
+    fear_animal = np.concatenate((np.full((batch_size, 1), n_species-1), closest[:, :-1]), axis=1)
+    points      = np.where(fear_animal >= 0, np.take_along_axis(field, np.maximum(fear_animal, 0), axis=1), 0)
+
+    counts     = np.arange(1, max_n_hand+1)
+    is_chasing = field[:, :, None] + counts >= 3
+    allowed    = hands[:, :, None] >= counts
+    return np.where(allowed, is_chasing * points[:, :, None], -1).reshape(batch_size, -1)
+
+class RolloutPolicy():
+    '''
+    How the actions are chosen once a simulation has left the tree of the player whose turn it is.
+
+    action_ids picks one action id (see action_table) for each of a batch of B games from their hands and field, shape (B, n_species).
+    It is all array operations, so the same policy serves a single game in Tree and a batch of games in batch_rollout.
+    Games whose hand is empty get an arbitrary action id, the caller ignores it.
+    '''
+    name = None
+
+    def action_ids(self, hands, field, max_n_hand, rng):
+        raise NotImplementedError
+
+    def select_action(self, game, player):
+        return game.action_event(player, int(self.action_ids(game.hand(player)[None], game.field[None], game.max_n_hand, game.rng)[0]))
+
+class UniformPolicy(RolloutPolicy):
+    # every allowed action is equally likely
+    name = "uniform"
+
+    def action_ids(self, hands, field, max_n_hand, rng):
+        # every (species, count) pair with count <= hand[species] is equally likely, like np.random.choice over Kariba.allowed_actions.
+        # numbering the pairs species by species, that's the same as picking a card from the hand uniformly:
+        # the species of the card is the species to play, its position among the cards of that species is the count
+        batch_idx  = np.arange(len(hands))
+        cumulative = np.cumsum(hands, axis=1)
+        pick       = (rng.random(len(hands)) * cumulative[:, -1]).astype(int)
+        species    = np.argmax(cumulative > pick[:, None], axis=1)
+        counts     = pick - (cumulative[batch_idx, species] - hands[batch_idx, species]) + 1
+        return species*max_n_hand + counts - 1
+
+    def select_action(self, game, player):
+        return game.action_event(player, game.rng.choice(game.legal_action_ids(player)))
+
+class EpsilonGreedyPolicy(RolloutPolicy):
+    '''
+    With probability 1-epsilon the action that chases away the most animals right now (see capture_points), a random one among equals.
+    With probability epsilon, and whenever no action chases anything away, every allowed action is equally likely
+    '''
+    name = "epsilon-greedy"
+
+    def __init__(self, epsilon=0.1):
+        self.epsilon = epsilon
+
+    def action_ids(self, hands, field, max_n_hand, rng):
+        points  = capture_points(hands, field, max_n_hand)
+        explore = rng.random(len(points)) < self.epsilon
+        points  = np.where(explore[:, None], np.minimum(points, 0), points) # exploring games only tell allowed from not allowed actions
+        return np.argmax(points + rng.random(points.shape), axis=1) # the points are whole numbers, so the noise only breaks ties
+
+class GreedyCapturePolicy(EpsilonGreedyPolicy):
+    # always the action that chases away the most animals, a random allowed action if there is none
+    name = "greedy-capture"
+
+    def __init__(self):
+        super().__init__(epsilon=0.0)
+
+policies = {policy.name : policy for policy in [UniformPolicy, GreedyCapturePolicy, EpsilonGreedyPolicy]}
+
+def from_name(name):
+    # "uniform", "greedy-capture", "epsilon-greedy" (with epsilon=0.1) or "epsilon-greedy=0.25"
+    name, _, epsilon = name.partition("=")
+    if name not in policies:
+        raise ValueError("unknown rollout policy: " + name)
+    if not epsilon:
+        return policies[name]()
+    if policies[name] is not EpsilonGreedyPolicy:
+        raise ValueError("the rollout policy " + name + " takes no epsilon")
+    return EpsilonGreedyPolicy(float(epsilon))
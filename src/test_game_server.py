@@ -0,0 +1,88 @@
+import time
+import asyncio
+import collections
+import concurrent.futures
+import numpy as np
+import pytest
+
+import kariba_moismcts
+import game_server
+
+def test_every_table_plays_a_legal_game():
+    async def play(executor):
+        server    = game_server.GameServer(executor, max_in_flight=2, n=20, deadline_ms=5000, seed=0)
+        scheduler = asyncio.create_task(server.run())
+        clients   = [game_server.LocalClient("table{}".format(i), seed=i, mistake_rate=0.2) for i in range(3)]
+        try:
+            scoreboards = await asyncio.gather(*[game_server.play_table(server, i, clients[i], n=20, seed=i) for i in range(3)])
+        finally:
+            scheduler.cancel()
+        return server, clients, scoreboards
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        server, clients, scoreboards = asyncio.run(play(executor))
+
+    for client, scoreboard in zip(clients, scoreboards):
+        kariba = client.table.kariba
+        assert kariba.is_final
+        assert scoreboard == dict(kariba.scoreboard)
+        assert (kariba.hands_ >= 0).all() and (kariba.field >= 0).all()
+        assert kariba.deck.sum() + kariba.hands_.sum() + kariba.field.sum() + kariba.scores_.sum() == kariba.n_species * max(3, kariba.n_species) # no card was made up or lost
+        for event, _, _, _ in kariba.history:
+            if event["kind"] == "action":
+                assert np.count_nonzero(event["cards"]) == 1
+        assert client.transcript[-1] == kariba.leading_player + " won!"
+    assert server.stats()["moves"] == sum(len([event for event, _, _, _ in client.table.kariba.history if event["kind"] == "action" and event["who"] == "Monty Carlos"]) for client in clients)
+
+def test_tables_are_served_round_robin():
+    server = game_server.GameServer(None, max_in_flight=1)
+    for table_id, n_requests in [(0, 3), (1, 1), (2, 2)]:
+        server.queues[table_id] = collections.deque(game_server.MoveRequest(table_id, None, 1, 0, None) for _ in range(n_requests))
+    order = []
+    while (request := server.next_request()) is not None:
+        order.append(request.table_id)
+    assert order == [0, 1, 2, 0, 2, 0]
+
+def test_missed_deadline_gets_the_fallback_move():
+    # without a scheduler nothing is dispatched, so the table stops waiting at the deadline
+    game   = kariba_moismcts.Kariba()
+    game.apply_event(game.random_card_draw())
+    server = game_server.GameServer(None, max_in_flight=1)
+    action = asyncio.run(server.request_move(0, game, deadline_ms=0))
+    assert action["action_id"] in game.legal_action_ids(game.whose_turn)
+    assert server.counters["deadlines_missed"] == 1
+    assert server.counters["searches"] == 0
+
+def test_no_time_left_gets_the_fallback_move():
+    # the margin is larger than the deadline, so the scheduler plays the fallback move instead of starting a search
+    async def request(server, game):
+        scheduler = asyncio.create_task(server.run())
+        try:
+            return await server.request_move(0, game)
+        finally:
+            scheduler.cancel()
+
+    game   = kariba_moismcts.Kariba()
+    game.apply_event(game.random_card_draw())
+    server = game_server.GameServer(None, max_in_flight=1, deadline_ms=1000, margin_ms=2000)
+    action = asyncio.run(request(server, game))
+    assert action["action_id"] in game.legal_action_ids(game.whose_turn)
+    assert server.counters["fallbacks"] == 1
+    assert server.counters["deadlines_missed"] == 0
+
+def test_worker_errors_reach_request_move():
+    async def request(server, game):
+        scheduler = asyncio.create_task(server.run())
+        try:
+            return await server.request_move(0, game)
+        finally:
+            scheduler.cancel()
+
+    game = kariba_moismcts.Kariba()
+    game.apply_event(game.random_card_draw())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        server = game_server.GameServer(executor, max_in_flight=1, deadline_ms=5000, searcher_options={"no_such_option" : True})
+        start  = time.monotonic()
+        with pytest.raises(TypeError):
+            asyncio.run(request(server, game))
+    assert time.monotonic() - start < 5 # the error came back before the deadline, it was not swallowed by the fallback
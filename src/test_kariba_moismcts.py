@@ -0,0 +1,43 @@
+import kariba_moismcts
+import util
+
+def tree_with_draw_child(seed=0):
+    # a transposition tree whose root, a decision node, also has a card-draw child (as when the root is reached before the draw in another simulation)
+    game = kariba_moismcts.Kariba(rng=util.make_rng(seed))
+    game.apply_event(game.random_card_draw())
+    tree  = kariba_moismcts.Tree(game, game.whose_turn, transpositions=True)
+    store = tree.store
+
+    observation = bytearray(store.observation(tree.root))
+    observation[0] += 1
+    draw_child = store.add(tree.root, False, bytes(observation), game.whose_turn_)
+    store.n[draw_child] = store.w[draw_child] = 100
+    store.n[tree.root]  = 100
+    return game, tree, draw_child
+
+def test_select_action_skips_draw_children():
+    game, tree, _ = tree_with_draw_child()
+    legal_action_ids = game.legal_action_ids(game.whose_turn)
+    for _ in range(len(legal_action_ids)):
+        action = tree.select_action()
+        assert action["action_id"] in legal_action_ids
+
+def test_best_action_skips_draw_children():
+    game, tree, _ = tree_with_draw_child()
+    action_id = int(game.legal_action_ids(game.whose_turn)[0])
+    game.apply_event(game.action_event(game.whose_turn, action_id))
+    child = tree.store.add(tree.root, True, tree.observation(), game.whose_turn_, action_id)
+    game.undo_event()
+    tree.store.n[child] = 1
+    assert tree.select_action(return_best_action=True)["action_id"] == action_id
+
+def test_transposition_self_play_stays_legal():
+    # a whole game with transpositions=True, every action the search returns has to be in the hand of the player
+    game = kariba_moismcts.Kariba(rng=util.make_rng(1))
+    while not game.is_final:
+        game.apply_event(game.random_card_draw())
+        action = kariba_moismcts.moismcts(game, n=100, seed=int(game.rng.integers(2**63)), transpositions=True)
+        assert action["action_id"] in game.legal_action_ids(game.whose_turn)
+        game.apply_event(action)
+        game.next_turn()
+    assert (game.hands_ >= 0).all() and (game.deck >= 0).all()
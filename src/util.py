@@ -19,3 +19,12 @@ def one_hot(idx, n_dim=8):
     x = np.zeros(n_dim, dtype=int)
     x[idx] = 1
     return x
+
+def make_rng(seed=None):
+    # seed can be None (fresh entropy), an int or a np.random.SeedSequence. SFC64 is the fastest of NumPy's bit generators
+    return np.random.Generator(np.random.SFC64(seed))
+
+def spawn_seeds(seed, n):
+    # n independent child streams of the same seed (None, an int or a np.random.SeedSequence), e.g. one per worker
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed_sequence.spawn(n)